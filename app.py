@@ -1,5 +1,6 @@
 # standard libraries
 import pandas as pd
+from backtest import load_backtest
 
 # dash and plotly
 import dash
@@ -161,6 +162,17 @@ main_panel_layout = html.Div(
     ],
 )
 
+# name of the saved backtest of every tab (name of the strategy in runner.strategy_names)
+backtest_names = {
+    'f_score': 'f_score',
+    'pead': 'pead',
+    'momentum': 'momentum',
+    'g_score': 'g_score',
+    'accruals': 'accrual_anatomy',
+    'beta': 'betting_against_beta',
+    'pairs': 'equity_pairs',
+}
+
 # bringing everything together, creating store-divs for used data
 root_layout = html.Div(
     id="root",
@@ -435,6 +447,29 @@ def create_explanation(strategy):
     return [text, long, short]
 
 
+@app.callback(
+    [
+        Output('store-backtests-stats', 'data'),
+        Output('store-backtests-prices', 'data'),
+        Output('store-backtests-weights', 'data')
+    ],
+    [
+        Input('radios', 'value')
+    ]
+
+)
+def load_backtests(strategy):
+    """
+    :return: statistics, portfolio values and weights of the backtest of the selected strategy (empty if there is no
+    backtest, see runner.py --backtest)
+    """
+    stats, prices, weights = load_backtest(backtest_names.get(strategy, strategy))
+    if stats is None:
+        return [{}, {}, {}]
+    return [stats, prices.to_json(orient='split', date_format='iso'),
+            weights.to_json(orient='split', date_format='iso')]
+
+
 if __name__ == "__main__":
     app.run_server(debug=False)
 app.scripts.config.serve_locally = True
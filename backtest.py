@@ -0,0 +1,219 @@
+import os
+import json
+from itertools import product
+import numpy as np
+import pandas as pd
+from data_store import data_context
+from stats import quantile_signals, trailing_means
+import strategies
+
+# folder of the saved backtests
+backtest_dir = './data/backtests'
+
+# number of periods per year for the annualized statistics
+periods_per_year = {'M': 12, 'W': 52, 'D': 252}
+
+
+def signal_weights(signals):
+    """
+    Creates equally weighted long and short legs out of the signals. Every leg is fully invested: the long weights sum
+    up to 1 and the short weights to -1 on every date.
+    :param signals: DataFrame (dates x stocks) with 'Long'/'Short' or 1/-1, everything else means no position
+    :return: DataFrame with the weight of every stock on every date
+    """
+    values = signals.to_numpy()
+    if values.dtype == object:
+        long = (values == 'Long') | (values == 1)
+        short = (values == 'Short') | (values == -1)
+    else:
+        long = values == 1
+        short = values == -1
+
+    return pd.DataFrame(leg_weights(long, short), index=signals.index, columns=signals.columns)
+
+
+def leg_weights(long, short):
+    """
+    :param long: boolean array (... x stocks), True for the stocks of the long leg
+    :param short: boolean array of the same shape, True for the stocks of the short leg
+    :return: array with equal weights that sum up to 1 in the long and to -1 in the short leg of every row
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.nan_to_num(long / long.sum(axis=-1, keepdims=True)) - \
+            np.nan_to_num(short / short.sum(axis=-1, keepdims=True))
+
+
+def backtest(signals, returns=None, holding_period=1, costs=0.0, freq='M'):
+    """
+    Backtests a long/short strategy. The signals of a date are traded at the end of that date and earn the returns of
+    the next period. With a holding period of several periods, every signal is held for that many periods and the
+    portfolio is the average of the overlapping portfolios. After the last rebalancing date no new portfolios are
+    formed, the backtest ends when the last portfolio has been held for the holding period. All dates and stocks are
+    calculated at once.
+    :param signals: DataFrame (rebalancing dates x stocks) with 'Long'/'Short' or 1/-1, p.e. the month ends
+    :param returns: DataFrame (periods x stocks) with the returns, None for the returns of all stocks of the frequency
+    :param holding_period: number of periods a signal is held
+    :param costs: trading costs as fraction of the traded value, p.e. 0.001 for 10 basis points
+    :param freq: 'M' for monthly, 'W' for weekly returns (only used without returns)
+    :return: dict with DataFrames: returns (long, short, long_short, turnover and net return per period), prices
+             (value of 1 invested in every portfolio) and weights (dates x stocks)
+    """
+    if returns is None:
+        returns = data_context.period_returns(freq)
+
+    # weights on every date of the returns, signals between the rebalancing dates are held. Stocks without returns get
+    # no position before the legs are weighted, so every leg stays fully invested
+    weights = signal_weights(signals.reindex(columns=returns.columns))
+    weights = weights.reindex(returns.index, method='ffill').fillna(0)
+    # no new portfolios after the last rebalancing date, the last ones run out with the holding period
+    if len(signals) > 0:
+        weights.iloc[returns.index.searchsorted(signals.index.max()) + 1:] = 0
+    weights = weights.rolling(holding_period, min_periods=1).mean()
+
+    # weights of the previous period earn the returns of this period (no return --> 0)
+    held = weights.shift(1).fillna(0).to_numpy()
+    period_returns = np.nan_to_num(returns.to_numpy())
+    long = (np.where(held > 0, held, 0) * period_returns).sum(axis=1)
+    short = (np.where(held < 0, held, 0) * period_returns).sum(axis=1)
+
+    # share of the portfolio traded on every date (sum of absolute weight changes of long and short leg)
+    turnover = np.abs(np.diff(weights.to_numpy(), axis=0, prepend=0)).sum(axis=1)
+
+    df_returns = pd.DataFrame({'long': long, 'short': -short, 'long_short': long + short}, index=returns.index)
+    # costs of a rebalancing are paid out of the returns of the next period
+    df_returns['turnover'] = turnover
+    df_returns['net'] = df_returns['long_short'] - costs * np.concatenate([[0], turnover[:-1]])
+
+    # only keep periods from the first signal until the last portfolio runs out
+    invested = np.flatnonzero(weights.abs().sum(axis=1).to_numpy() > 0)
+    if len(invested) > 0:
+        df_returns = df_returns.iloc[invested[0] + 1:invested[-1] + 2]
+        weights = weights.iloc[invested[0]:invested[-1] + 1]
+
+    df_prices = (df_returns[['long', 'short', 'long_short', 'net']] + 1).cumprod()
+    return {'returns': df_returns, 'prices': df_prices, 'weights': weights}
+
+
+def backtest_stats(df_returns, freq='M'):
+    """
+    :param df_returns: returns of a backtest (see backtest)
+    :param freq: frequency of the returns, 'M', 'W' or 'D'
+    :return: dict with the annualized return and volatility, sharpe ratio (without risk free rate), maximum drawdown,
+             share of positive periods and average turnover of the net long/short returns
+    """
+    returns = df_returns['net']
+    periods = periods_per_year[freq]
+    prices = (returns + 1).cumprod()
+
+    annual_return = prices.iloc[-1] ** (periods / len(returns)) - 1 if len(returns) > 0 else np.nan
+    volatility = returns.std() * np.sqrt(periods)
+    return {
+        'periods': int(len(returns)),
+        'annual_return': float(annual_return),
+        'annual_volatility': float(volatility),
+        'sharpe_ratio': float(returns.mean() * periods / volatility) if volatility > 0 else np.nan,
+        'max_drawdown': float((prices / prices.cummax() - 1).min()),
+        'hit_rate': float((returns > 0).mean()),
+        'avg_turnover': float(df_returns['turnover'].mean()),
+    }
+
+
+def save_backtest(name, result, freq='M'):
+    """
+    Saves the statistics, portfolio values and weights of a backtest for the app.
+    :param name: name of the strategy, p.e. 'momentum'
+    :param result: result of backtest
+    :param freq: frequency of the returns
+    :return: statistics of the backtest
+    """
+    os.makedirs(backtest_dir, exist_ok=True)
+    stats = backtest_stats(result['returns'], freq)
+    with open(f'{backtest_dir}/{name}_stats.json', 'w') as file:
+        json.dump(stats, file, indent=2)
+    result['prices'].to_parquet(f'{backtest_dir}/{name}_prices.parquet')
+    # only stocks with a position, the weights are mostly zero
+    weights = result['weights']
+    weights = weights.loc[:, (weights != 0).any()]
+    weights.to_parquet(f'{backtest_dir}/{name}_weights.parquet')
+    return stats
+
+
+def load_backtest(name):
+    """
+    :param name: name of the strategy
+    :return: tuple of statistics (dict), portfolio values and weights (DataFrames), all None if there is no backtest
+    """
+    if not os.path.exists(f'{backtest_dir}/{name}_stats.json'):
+        return None, None, None
+    with open(f'{backtest_dir}/{name}_stats.json') as file:
+        stats = json.load(file)
+    return stats, pd.read_parquet(f'{backtest_dir}/{name}_prices.parquet'), \
+        pd.read_parquet(f'{backtest_dir}/{name}_weights.parquet')
+
+
+def run_backtests(signals=None, holding_period=3, costs=0.001):
+    """
+    Backtests the strategies with signals for every month and saves the results for the app.
+    :param signals: dict with name of the strategy and DataFrame (months x stocks) with the signals, p.e. of
+                    runner.walk_forward, None for the momentum signals of every month
+    :param holding_period: number of months a signal is held
+    :param costs: trading costs as fraction of the traded value
+    :return: dict with name and statistics of every backtest
+    """
+    if signals is None:
+        signals = {'momentum': strategies.momentum_signals()}
+    return {name: save_backtest(name, backtest(panel, holding_period=holding_period, costs=costs))
+            for name, panel in signals.items()}
+
+
+def momentum_sweep(lookbacks=range(2, 13), skips=(1,), holding_periods=(1, 3, 6, 12), costs=0.001, monthly=None):
+    """
+    Backtests the momentum strategy for a grid of lookback periods, skipped months and holding periods at once. The
+    average returns of all lookbacks come out of one cumulative sum of the monthly returns, the stocks of all lookbacks
+    and months are ranked in one batch and every holding period is a rolling sum over all lookbacks at once. A grid of
+    12 x 12 costs little more than one backtest.
+    :param lookbacks: lookback periods in months, including the skipped months (12 with 1 skipped month is the
+                      momentum strategy of the app)
+    :param skips: number of latest months left out of the average return
+    :param holding_periods: number of months a signal is held
+    :param costs: trading costs as fraction of the traded value
+    :param monthly: monthly returns (see strategies.monthly_returns), None to calculate them
+    :return: DataFrame with one row per lookback, skip and holding period and the statistics of the backtest
+             (see backtest_stats)
+    """
+    df = monthly if monthly is not None else strategies.monthly_returns()
+    returns = np.nan_to_num(df.to_numpy(dtype=float))
+    grid = [(lookback, skip) for lookback, skip in product(lookbacks, skips) if lookback > skip]
+
+    # signals and weights of every lookback and skip (grid x months x stocks)
+    means = trailing_means(df.to_numpy(dtype=float), [lookback - skip for lookback, skip in grid],
+                           [skip for lookback, skip in grid])
+    signals = quantile_signals(means, 0.1)
+    weights = leg_weights(signals == 1, signals == -1)
+    cumulative = np.cumsum(weights, axis=1)
+
+    results = []
+    for holding_period in holding_periods:
+        # average of the overlapping portfolios of the last holding_period months
+        held = cumulative.copy()
+        held[:, holding_period:] -= cumulative[:, :-holding_period]
+        held /= np.minimum(np.arange(1, len(df) + 1), holding_period)[:, None]
+
+        # weights of the previous month earn the returns of this month
+        previous = np.zeros(held.shape)
+        previous[:, 1:] = held[:, :-1]
+        long = (np.where(previous > 0, previous, 0) * returns).sum(axis=-1)
+        short = (np.where(previous < 0, previous, 0) * returns).sum(axis=-1)
+        turnover = np.abs(np.diff(held, axis=1, prepend=0)).sum(axis=-1)
+        net = long + short - costs * np.concatenate([np.zeros((len(grid), 1)), turnover[:, :-1]], axis=1)
+
+        for position, (lookback, skip) in enumerate(grid):
+            df_returns = pd.DataFrame({'net': net[position], 'turnover': turnover[position]}, index=df.index)
+            # only months after the first signal
+            invested = np.flatnonzero(np.abs(held[position]).sum(axis=-1) > 0)
+            if len(invested) > 0:
+                df_returns = df_returns.iloc[invested[0] + 1:]
+            results.append({'lookback': lookback, 'skip': skip, 'holding_period': holding_period,
+                            **backtest_stats(df_returns)})
+
+    return pd.DataFrame(results).sort_values(['lookback', 'skip', 'holding_period'], ignore_index=True)
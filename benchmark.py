@@ -0,0 +1,433 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import create_data
+from data_store import stock_returns_file
+from instrumentation import recorder
+from prices import LocalPriceProvider, PriceStore, market_index_ticker
+import runner
+
+# balance sheet tags are values at a date (qtrs = 0), all other tags are values for a period (qtrs = 1 to 4)
+balance_sheet_tags = ['AssetsCurrent', 'CashAndCashEquivalentsAtCarryingValue', 'LiabilitiesCurrent', 'Liabilities',
+                      'Assets', 'StockholdersEquity', 'OtherLiabilitiesNoncurrent']
+
+# tags in the num files that are not needed, the ingestion has to filter them out
+other_tags = ['Goodwill', 'InventoryNet', 'AccountsPayableCurrent', 'InterestExpense']
+
+# size of the values of every tag relative to the assets of the company (mean and standard deviation per year)
+tag_ratios = {
+    'AssetsCurrent': (0.4, 0.1),
+    'CashAndCashEquivalentsAtCarryingValue': (0.1, 0.05),
+    'LiabilitiesCurrent': (0.25, 0.1),
+    'Liabilities': (0.6, 0.15),
+    'Assets': (1.0, 0.0),
+    'StockholdersEquity': (0.4, 0.15),
+    'OtherLiabilitiesNoncurrent': (0.05, 0.02),
+    'IncomeTaxesPaid': (0.02, 0.01),
+    'IncomeTaxesPaidNet': (0.02, 0.01),
+    'DepreciationDepletionAndAmortization': (0.04, 0.01),
+    'OperatingIncomeLoss': (0.05, 0.08),
+    'NetCashProvidedByUsedInOperatingActivities': (0.07, 0.08),
+    'RevenueFromContractWithCustomerExcludingAssessedTax': (0.8, 0.3),
+    'CostOfGoodsAndServicesSold': (0.5, 0.2),
+    'CostOfRevenue': (0.5, 0.2),
+    'Revenues': (0.8, 0.3),
+    'ResearchAndDevelopmentExpense': (0.03, 0.02),
+    'SellingGeneralAndAdministrativeExpense': (0.1, 0.04),
+    'PaymentsToAcquirePropertyPlantAndEquipment': (0.05, 0.02),
+    'Goodwill': (0.1, 0.05),
+    'InventoryNet': (0.1, 0.05),
+    'AccountsPayableCurrent': (0.08, 0.03),
+    'InterestExpense': (0.01, 0.005),
+}
+
+# sic codes of the companies, several companies per 2-digit industry
+sic_codes = [1311, 1381, 2834, 2836, 3571, 3572, 3674, 4911, 4931, 5812, 6022, 6798, 7372, 7373, 8062]
+
+# folder of the benchmark results
+benchmark_dir = './data/benchmarks'
+
+
+def generate_companies(companies, seed=0):
+    """
+    :param companies: number of companies
+    :param seed: seed of the random numbers, the same seed creates the same companies
+    :return: DataFrame with cik, ticker, name, sic and the size (assets) of every company
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'cik': 1000 + np.arange(companies) * 37,
+        'ticker': [f'T{company:05d}' for company in range(companies)],
+        'name': [f'COMPANY {company}' for company in range(companies)],
+        'sic': rng.choice(sic_codes, companies),
+        'assets': np.exp(rng.normal(20, 1.5, companies)),
+    })
+
+
+def generate_ticker_file(path, df_companies, seed=0):
+    """
+    Writes a ticker file in the format of the SEC (company_tickers.json). Some companies have a second ticker.
+    :param path: path of the ticker file
+    :param df_companies: companies (see generate_companies)
+    :param seed: seed of the random numbers
+    """
+    rng = np.random.default_rng(seed)
+    entries = [{'cik_str': int(cik), 'ticker': ticker, 'title': name}
+               for cik, ticker, name in zip(df_companies['cik'], df_companies['ticker'], df_companies['name'])]
+    # holdings with several tickers
+    for company in np.flatnonzero(rng.random(len(df_companies)) < 0.01):
+        cik, ticker, name = df_companies.iloc[company][['cik', 'ticker', 'name']]
+        entries.append({'cik_str': int(cik), 'ticker': f'{ticker}B', 'title': name})
+    with open(path, 'w') as file:
+        json.dump({str(position): entry for position, entry in enumerate(entries)}, file)
+
+
+def generate_quarter(df_companies, year, quarter, growth, rng):
+    """
+    Creates the sub and num data of the statements of one quarter: a 10-Q for quarters 1 to 3 and a 10-K for quarter 4,
+    filed 35 to 60 days after the end of the quarter. Like the SEC data, the num data contains the values of the
+    previous year, year to date values, unused tags and some amended statements.
+    :param df_companies: companies (see generate_companies)
+    :param year: fiscal year
+    :param quarter: fiscal quarter
+    :param growth: array with the growth of the assets of every company since the first year
+    :param rng: numpy random generator
+    :return: tuple of sub and num data
+    """
+    period = pd.Timestamp(year=year, month=3 * quarter, day=1) + pd.offsets.MonthEnd(0)
+    previous_period = period - pd.offsets.YearEnd(1) if quarter == 4 else period - pd.DateOffset(years=1)
+
+    # statements of the quarter, some companies do not file, some file twice (amendment)
+    companies = np.flatnonzero(rng.random(len(df_companies)) > 0.03)
+    amended = companies[rng.random(len(companies)) < 0.02]
+    companies = np.concatenate([companies, amended])
+    statements = len(companies)
+    filed = period + pd.to_timedelta(rng.integers(35, 61, statements) + np.r_[np.zeros(statements - len(amended)),
+                                                                              np.full(len(amended), 10)], unit='D')
+    adsh = pd.Series(df_companies['cik'].to_numpy()[companies]).map('{:010d}'.format) + \
+        f'-{year % 100:02d}-{quarter}' + pd.Series(np.arange(statements)).map('{:06d}'.format)
+    form = '10-K' if quarter == 4 else '10-Q'
+
+    sub = pd.DataFrame({
+        'adsh': adsh,
+        'cik': df_companies['cik'].to_numpy()[companies],
+        'name': df_companies['name'].to_numpy()[companies],
+        'sic': df_companies['sic'].to_numpy()[companies],
+        'form': form,
+        'filed': filed.strftime('%Y%m%d'),
+        'period': period.strftime('%Y%m%d'),
+        'accepted': filed.strftime('%Y-%m-%d 16:05:00.0'),
+        'fy': year,
+        'fp': 'FY' if quarter == 4 else f'Q{quarter}',
+    })
+
+    # values of every statement and tag, about 5 % of the tags are missing
+    assets = df_companies['assets'].to_numpy()[companies] * growth[companies]
+    q4_only = df_companies['cik'].to_numpy()[companies] % 5 == 0
+    num = []
+    for tag, (mean, std) in tag_ratios.items():
+        if tag not in create_data.tags and tag not in other_tags:
+            continue
+        reported = rng.random(statements) > 0.05
+        annual_value = assets * (mean + std * rng.standard_normal(statements))
+        if tag in balance_sheet_tags or tag in other_tags:
+            # value at the end of the period and at the end of the previous year
+            periods = [(period, 0, annual_value, reported), (previous_period, 0, annual_value / 1.05, reported)]
+        else:
+            # value of the quarter and of the year to date, the 10-K of some companies only has the full year
+            quarter_value = annual_value / 4
+            periods = [(period, quarter, quarter_value * quarter, reported),
+                       (period, 1, quarter_value, reported & ~(q4_only & (quarter == 4))),
+                       (previous_period, quarter, quarter_value * quarter / 1.05, reported)]
+            if quarter == 1:
+                periods = periods[:1] + periods[2:]
+        for ddate, qtrs, value, mask in periods:
+            num.append(pd.DataFrame({'adsh': adsh[mask].to_numpy(), 'tag': tag, 'version': 'us-gaap/2020',
+                                     'ddate': ddate.strftime('%Y%m%d'), 'qtrs': qtrs, 'uom': 'USD',
+                                     'value': np.round(value[mask], 0)}))
+
+    # earnings and shares
+    shares = assets / 50
+    for tag, value, qtrs in [('WeightedAverageNumberOfSharesOutstandingBasic', shares, 4 if quarter == 4 else 1),
+                             ('EarningsPerShareBasic', rng.normal(2, 3, statements) / (4 if quarter < 4 else 1),
+                              4 if quarter == 4 else 1)]:
+        num.append(pd.DataFrame({'adsh': adsh.to_numpy(), 'tag': tag, 'version': 'us-gaap/2020',
+                                 'ddate': period.strftime('%Y%m%d'), 'qtrs': qtrs, 'uom': 'USD',
+                                 'value': np.round(value, 2)}))
+    return sub, pd.concat(num, ignore_index=True)
+
+
+def generate_sec_data(folder, companies=1000, years=1, last_year=2021, seed=0):
+    """
+    Writes deterministic data in the shape of the SEC financial statement data sets: the ticker file and one folder
+    with a sub.txt and a num.txt file per quarter (./data/2021q1/).
+    :param folder: data folder
+    :param companies: number of companies
+    :param years: number of fiscal years
+    :param last_year: last fiscal year
+    :param seed: seed of the random numbers, the same seed creates the same files
+    :return: companies (see generate_companies)
+    """
+    rng = np.random.default_rng(seed)
+    df_companies = generate_companies(companies, seed)
+    os.makedirs(folder, exist_ok=True)
+    generate_ticker_file(f'{folder}/ticker.txt', df_companies, seed)
+
+    growth = np.ones(companies)
+    for year in range(last_year - years + 1, last_year + 1):
+        growth = growth * np.exp(rng.normal(0.05, 0.15, companies))
+        for quarter in range(1, 5):
+            sub, num = generate_quarter(df_companies, year, quarter, growth, rng)
+            # statements are filed in the quarter after the end of the period
+            filed = pd.Timestamp(year=year, month=3 * quarter, day=1) + pd.DateOffset(months=3)
+            quarter_folder = f'{folder}/{filed.year}q{filed.quarter}'
+            os.makedirs(quarter_folder, exist_ok=True)
+            sub.to_csv(f'{quarter_folder}/sub.txt', sep='\t', index=False)
+            num.to_csv(f'{quarter_folder}/num.txt', sep='\t', index=False)
+    return df_companies
+
+
+def generate_prices(tickers, start, end, seed=0, index_ticker=None):
+    """
+    Creates daily close prices out of a market factor and stock specific returns. Some stocks start trading later and
+    some stop trading (delisted).
+    :param tickers: list of stock tickers
+    :param start: first date
+    :param end: last date
+    :param seed: seed of the random numbers, the same seed creates the same prices
+    :param index_ticker: ticker of a market index out of the market factor as additional column, None for no index
+    :return: DataFrame with the close prices, one column per ticker
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, end, name='Date')
+    stocks = len(tickers)
+
+    market = rng.normal(0.0003, 0.01, len(dates))[:, None]
+    beta = rng.uniform(0.5, 1.5, stocks)
+    returns = market * beta + rng.normal(0, 0.02, (len(dates), stocks))
+    prices = rng.uniform(10, 100, stocks) * np.cumprod(1 + returns, axis=0)
+
+    # listings and delistings
+    rows = np.arange(len(dates))[:, None]
+    first = np.where(rng.random(stocks) < 0.1, rng.integers(0, len(dates), stocks), 0)
+    last = np.where(rng.random(stocks) < 0.05, rng.integers(0, len(dates), stocks), len(dates))
+    prices[(rows < first) | (rows >= last)] = np.nan
+    df_prices = pd.DataFrame(prices, index=dates, columns=tickers)
+    if index_ticker is not None:
+        df_prices[index_ticker] = 1000 * np.cumprod(1 + market[:, 0])
+    return df_prices
+
+
+def idle():
+    """
+    Does nothing, the measurement of the process without any work (see measure).
+    """
+    return None
+
+
+def timed_call(function, args, kwargs):
+    """
+    Runs a function in the process of a measurement (see measure). The function runs as a stage of the recorder, so
+    its peak includes the peaks of its own stages.
+    :param function: function to measure
+    :param args: positional arguments of the function
+    :param kwargs: keyword arguments of the function
+    :return: tuple of the result (None if the function raised an error), wall time in seconds, peak resident memory of
+             the process in bytes, list of the records of the stages of the function and the error
+    """
+    first = len(recorder.records)
+    start = time.perf_counter()
+    try:
+        with recorder.stage(function.__name__):
+            result, error = function(*args, **kwargs), None
+    # a benchmark of a strategy that fails on the data should not stop the other benchmarks
+    except Exception as exception:
+        result, error = None, f'{type(exception).__name__}: {exception}'
+    wall_time = time.perf_counter() - start
+    # the stage of the whole function is the last record
+    records = recorder.records[first:]
+    return result, wall_time, records[-1]['peak_rss'], records[:-1], error
+
+
+def measure(function, *args, baseline_rss=None, **kwargs):
+    """
+    Runs a function in a new process and measures its wall time and the peak resident memory of that process (the
+    interpreter, the imported modules and everything the function reads and creates, not its worker processes). The
+    new process starts without any data in memory, so every measurement reads its files again and the peak is not
+    raised by earlier measurements. The time is measured without any tracing of the allocations.
+    :param function: function to measure (importable, p.e. runner.run)
+    :param baseline_rss: peak resident memory of a process without any work (measure(idle)), None for no increase
+    :return: tuple of the result (None if the function raised an error) and a dict with wall time in seconds, peak
+             resident memory in bytes (None if the platform does not tell), its increase over the baseline, the records
+             of the stages of the function (see instrumentation.StageRecorder) and the error
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        result, wall_time, peak, stages, error = executor.submit(timed_call, function, args, kwargs).result()
+
+    record = {'wall_time': round(wall_time, 4), 'peak_rss': peak}
+    if baseline_rss is not None and peak is not None:
+        record['peak_rss_increase'] = peak - baseline_rss
+    record['stages'] = stages
+    if error is not None:
+        record['error'] = error
+    return result, record
+
+
+def run_benchmark(companies=1000, years=5, strategies=None, workers=1, seed=0, folder=None):
+    """
+    Creates synthetic data of the given size and measures the ingestion (create_annual_data, create_quarterly_data and
+    create_financial_data) and every strategy on it. Every strategy is measured on its own including its intermediate
+    data and the reading of the files, in a process of its own (see measure). The peak memory of a process that only
+    imports the modules is measured first, every measurement also reports its increase over that baseline.
+    :param companies: number of companies
+    :param years: number of fiscal years of the financial statement data and the prices
+    :param strategies: list of the strategies, None for all strategies
+    :param workers: number of processes of the ingestion
+    :param seed: seed of the random numbers
+    :param folder: working folder for the synthetic data, None for a temporary folder that is deleted afterwards
+    :return: dict with the size of the data, the baseline memory and wall time, peak memory and stages of every
+             ingestion step and strategy
+    """
+    strategies = strategies if strategies is not None else runner.strategy_names
+    last_year = 2021
+    temporary = folder is None
+    folder = tempfile.mkdtemp(prefix='benchmark_') if temporary else folder
+    current_folder = os.getcwd()
+
+    try:
+        # the code reads and writes ./data --> run in the working folder
+        os.chdir(folder)
+        start = time.perf_counter()
+        df_companies = generate_sec_data('./data', companies, years, last_year, seed)
+        df_prices = generate_prices(df_companies['ticker'].tolist(), f'{last_year - years + 1}-01-01',
+                                    f'{last_year + 1}-03-31', seed, market_index_ticker)
+        df_prices.drop(columns=market_index_ticker).to_parquet(stock_returns_file, compression='gzip')
+        # the market index of betting against beta is read out of the price store
+        PriceStore(provider=LocalPriceProvider(df_prices[[market_index_ticker]])).update(
+            [market_index_ticker], df_prices.index[0])
+        generate_time = time.perf_counter() - start
+
+        # interpreter and imported modules
+        baseline_rss = measure(idle)[1]['peak_rss']
+
+        quarters = [f'{year}Q{quarter}' for year in range(last_year - years + 1, last_year + 1)
+                    for quarter in range(1, 5)]
+        stages = {}
+        for name, function, args in [('create_annual_data', create_data.create_annual_data, (create_data.tags,)),
+                                     ('create_quarterly_data', create_data.create_quarterly_data,
+                                      (quarters, create_data.tags)),
+                                     ('create_financial_data', create_data.create_financial_data,
+                                      (quarters, create_data.tags))]:
+            result, stages[name] = measure(function, *args, baseline_rss=baseline_rss, workers=workers)
+            if isinstance(result, tuple):
+                stages[name]['rows'] = [len(df) for df in result]
+            elif result is not None:
+                stages[name]['rows'] = len(result)
+
+        results = {}
+        for name in strategies:
+            signals, results[name] = measure(runner.run, [name], baseline_rss=baseline_rss)
+            if signals is not None:
+                results[name]['signals'] = len(signals[name])
+    finally:
+        os.chdir(current_folder)
+        if temporary:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    return {
+        'companies': companies,
+        'years': years,
+        'seed': seed,
+        'workers': workers,
+        'generate_time': round(generate_time, 4),
+        'baseline_rss': baseline_rss,
+        'stages': stages,
+        'strategies': results,
+    }
+
+
+def environment():
+    """
+    :return: dict with the versions of Python, pandas and numpy and the number of cores
+    """
+    return {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+            'cores': os.cpu_count(), 'created': pd.Timestamp.now().isoformat(timespec='seconds')}
+
+
+def save_benchmarks(results, path):
+    """
+    :param results: list of benchmark results (see run_benchmark)
+    :param path: path of the JSON file
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump({'environment': environment(), 'benchmarks': results}, file, indent=2)
+
+
+def compare_benchmarks(old_path, new_path, tolerance=0.2):
+    """
+    Compares two saved benchmark runs of the same sizes, p.e. of the last version and of the current version.
+    :param old_path: JSON file of the earlier run
+    :param new_path: JSON file of the later run
+    :param tolerance: allowed increase of wall time and peak memory over the baseline, p.e. 0.2 for 20 %
+    :return: DataFrame with one row per size, stage and measure and the ratio new / old, regressions first
+    """
+    runs = []
+    for path in [old_path, new_path]:
+        with open(path) as file:
+            runs.append({(benchmark['companies'], benchmark['years']): benchmark
+                         for benchmark in json.load(file)['benchmarks']})
+    old, new = runs
+
+    rows = []
+    for size in old.keys() & new.keys():
+        for group in ['stages', 'strategies']:
+            for name in old[size][group].keys() & new[size][group].keys():
+                for measure_name in ['wall_time', 'peak_rss_increase']:
+                    before = old[size][group][name].get(measure_name)
+                    after = new[size][group][name].get(measure_name)
+                    rows.append({'companies': size[0], 'years': size[1], 'name': name, 'measure': measure_name,
+                                 'old': before, 'new': after,
+                                 'ratio': after / before if before and after is not None else np.nan})
+
+    df = pd.DataFrame(rows, columns=['companies', 'years', 'name', 'measure', 'old', 'new', 'ratio'])
+    df['regression'] = df['ratio'] > 1 + tolerance
+    return df.sort_values(['regression', 'ratio'], ascending=False, ignore_index=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures ingestion and strategies on synthetic data.')
+    parser.add_argument('--companies', type=int, nargs='+', default=[1000], help='numbers of companies')
+    parser.add_argument('--years', type=int, nargs='+', default=[5], help='numbers of years')
+    parser.add_argument('--strategies', nargs='+', metavar='strategy',
+                        help=f'strategies to measure (default: all): {", ".join(runner.strategy_names)}')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes of the ingestion')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    parser.add_argument('--output', default=f'{benchmark_dir}/benchmark.json', help='JSON file for the results')
+    parser.add_argument('--compare', metavar='OLD', help='JSON file of an earlier run to compare the results with')
+    args = parser.parse_args()
+    unknown = [strategy for strategy in args.strategies or [] if strategy not in runner.strategy_names]
+    if unknown:
+        parser.error(f'unknown strategies: {", ".join(unknown)}')
+
+    benchmarks = []
+    for companies in args.companies:
+        for years in args.years:
+            benchmark = run_benchmark(companies, years, args.strategies, args.workers, args.seed)
+            benchmarks.append(benchmark)
+            for group in ['stages', 'strategies']:
+                for name, record in benchmark[group].items():
+                    summary = {key: value for key, value in record.items() if key != 'stages'}
+                    print(f'{companies} companies, {years} years, {name}: {summary}')
+    save_benchmarks(benchmarks, args.output)
+
+    if args.compare:
+        print(compare_benchmarks(args.compare, args.output).to_string())
@@ -1,7 +1,14 @@
 import pandas as pd
 import numpy as np
 import os
-import yfinance as yf
+import json
+import zipfile
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from prices import PriceStore, market_index_ticker
+from instrumentation import collect, recorder
+from data_store import compact_dtypes, concat_compact, save_financials, load_financials, stock_returns_file
 
 # tags (part of statement to keep)
 tags = ['AssetsCurrent', 'CashAndCashEquivalentsAtCarryingValue', 'LiabilitiesCurrent', 'Liabilities',
@@ -19,16 +26,23 @@ quarters = ['2017Q4', '2018Q1', '2018Q2', '2018Q3', '2018Q4', '2019Q1', '2019Q2'
 # year of last annual statement
 year = 2020
 
+# number of processes reading the quarter folders in parallel, every process holds one quarter in memory
+workers = 4
 
-def create_quarterly_data(quarters, tags):
+# approximate memory in bytes for reading one chunk of a num file, per process (None reads one million rows at once)
+memory_budget = 512 * 1024 ** 2
+
+# folder for the transformed quarters and the manifest of already transformed quarters (incremental mode)
+cache_dir = './data/cache'
+
+# version of the transformed quarters in the cache, a new version transforms all quarters again
+cache_version = 2
+
+
+def load_ticker():
     """
-    :param quarters: quarters for which financial statement should be considered
-    :param tags: parts of financial statement which should be considered
-    :return: returns quarterly data for all tags and quarters
+    :return: mapping between cik and company ticker, some cik's have more than one ticker --> only keep the first
     """
-    # final DataFrame
-    financial_statement = pd.DataFrame()
-
     # get ticker data
     ticker = pd.read_json('./data/ticker.txt').T
     # transform ticker
@@ -37,163 +51,338 @@ def create_quarterly_data(quarters, tags):
     ticker['cik'] = ticker['cik'].astype(str)
     # some cik's have more than one ticker
     ticker = ticker.drop_duplicates(subset='cik')
+    return ticker
 
-    # iterate though all the folders in data
-    for folder in os.listdir('./data'):
-        if folder.startswith("20"):
-            print(folder)
-            # import data
-            sub = pd.read_csv(f"./data/{folder}/sub.txt", sep="\t", dtype={"cik": str})
-            num = pd.read_csv(f"./data/{folder}/num.txt", sep="\t")
 
-            # transform sub data
-            # filter for needed columns
-            cols = ['adsh', 'cik', 'name', 'sic', 'form', 'filed', 'period', 'accepted', 'fy', 'fp']
-            sub = sub[cols]
+def list_quarters():
+    """
+    The quarters can be saved as extracted folders (./data/2021q1/) or as the zip archives downloaded from the SEC
+    (./data/2021q1.zip). If a quarter is there in both ways, the extracted folder is used.
+    :return: dictionary with the name of every quarter and its folder or zip archive, sorted by quarter
+    """
+    sources = {}
+    for entry in sorted(os.listdir('./data')):
+        if entry.startswith("20") and entry.endswith('.zip'):
+            sources.setdefault(entry[:-len('.zip')], entry)
+        elif entry.startswith("20") and os.path.isdir(f'./data/{entry}'):
+            sources[entry] = entry
+    return dict(sorted(sources.items()))
 
-            # change to datetype
-            sub["accepted"] = pd.to_datetime(sub["accepted"])
-            sub["period"] = pd.to_datetime(sub["period"], format="%Y%m%d")
-            sub["filed"] = pd.to_datetime(sub["filed"], format="%Y%m%d")
 
-            # filter for quarterly and annual financial data
-            sub = sub[sub['form'].isin(['10-K', '10-Q'])]
+@contextmanager
+def open_quarter_file(source, file):
+    """
+    Opens the sub or num file of a quarter. Files in zip archives are streamed out of the archive without extracting.
+    :param source: name of the quarter folder or zip archive in ./data
+    :param file: name of the file, p.e. num.txt
+    :return: file object to read from
+    """
+    if source.endswith('.zip'):
+        with zipfile.ZipFile(f'./data/{source}') as archive, archive.open(file) as member:
+            yield member
+    else:
+        with open(f'./data/{source}/{file}', 'rb') as member:
+            yield member
 
-            # delete duplicates --> company handed in same file in same period --> only keep newest
-            sub = sub.loc[sub.sort_values(by=["filed", "accepted"], ascending=False).groupby(["cik", "period"]).cumcount() == 0]
 
-            # drop not needed columns
-            sub = sub.drop(['filed', 'period', 'accepted', 'fy', 'fp'], axis=1)
+def read_num(path, tags, memory_budget=None):
+    """
+    Reads the num file in chunks. Every chunk is reduced to the needed columns and tags before the next one is read, so
+    only the small part of the file that is actually used is kept in memory.
+    :param path: path to the num file or an open num file
+    :param tags: parts of financial statement which should be considered
+    :param memory_budget: approximate memory in bytes for reading one chunk, None reads chunks of one million rows
+    :return: DataFrame with the columns adsh, tag, ddate, qtrs and value for the needed tags
+    """
+    cols_num = ['adsh', 'tag', 'ddate', 'qtrs', 'value']
+    chunksize = 10000 if memory_budget else 1000000
+    chunks = []
 
-            # merge ticker and sub data
-            sub = sub.merge(ticker)
+    with pd.read_csv(path, sep="\t", usecols=cols_num, dtype={'value': float}, iterator=True) as reader:
+        while True:
+            try:
+                chunk = reader.get_chunk(chunksize)
+            except StopIteration:
+                break
 
-            # transform num data
-            # change to datetype
-            num["ddate"] = pd.to_datetime(num["ddate"], format="%Y%m%d")
+            # size the next chunks to the memory budget based on the memory per row of the first chunk
+            # parsing a chunk needs about twice the memory of the parsed chunk
+            if memory_budget and not chunks:
+                row_bytes = chunk.memory_usage(deep=True).sum() / max(len(chunk), 1)
+                chunksize = max(int(memory_budget / (2 * row_bytes)), 1000)
 
-            # filter for needed columns
-            cols_num = ['adsh', 'tag', 'ddate', 'qtrs', 'value']
-            num = num[cols_num]
+            # filter for needed tags
+            chunks.append(chunk[chunk['tag'].isin(tags)])
 
-            # only select current date and quarter
-            num = num.loc[
-                num.sort_values(by=["ddate", "qtrs"], ascending=(False, True)).groupby(["adsh", "tag"]).cumcount() == 0]
+    if not chunks:
+        return pd.DataFrame(columns=cols_num)
+    return pd.concat(chunks, ignore_index=True)[cols_num]
 
-            # create quarter and year column
-            num['quarter'] = num['ddate'].dt.quarter
-            num['year'] = num['ddate'].dt.year
 
-            # merge num and sub data
-            num = num.merge(sub)
+def select_statements(sub, num, ticker, quarterly):
+    """
+    Keeps the newest statement of every company and period and the current values of every statement and merges them.
+    :param sub: sub data of one quarter with the forms that should be considered
+    :param num: num data of the same quarter
+    :param ticker: mapping between cik and company ticker
+    :param quarterly: True for quarterly data (keep single quarter values), False for annual data (keep full year values)
+    :return: DataFrame with the values of every statement and tag
+    """
+    # delete duplicates --> company handed in same file in same period --> only keep newest
+    sub = sub.loc[sub.sort_values(by=["filed", "accepted"], ascending=False).groupby(["cik", "period"]).cumcount() == 0]
 
-            # append to financial statement
-            financial_statement = financial_statement.append(num)
+    # drop not needed columns, the filing date shows from when on the values were known
+    sub = sub.drop(['period', 'accepted', 'fy', 'fp'], axis=1)
 
-    # filter for needed tags
-    financial_statement = financial_statement[financial_statement.loc[:, 'tag'].isin(tags)]
-    financial_statement = financial_statement.sort_values(by='ddate')
+    # merge ticker and sub data
+    sub = sub.merge(ticker)
 
-    # create Q4 data
-    for idx, row in financial_statement.iterrows():
-        # when form is 10-K --> annual report --> change to quarterly
-        if row['form'] == '10-K':
-            # some companies only deliver full year numbers (qtrs = 4)
-            if row['qtrs'] == 4:
-                # filter for company and tag, select index of last 3 quarters
-                idx_list = financial_statement[
-                    (financial_statement.loc[:, 'ticker'] == row['ticker']) &
-                    (financial_statement.loc[:, 'tag'] == row['tag'])].index.values.tolist()
-                idx_position = idx_list.index(idx)
-                idx_list = idx_list[idx_position - 3:idx_position]
-                # subtract sum of all quarters from full year number
-                financial_statement.at[idx, 'value'] = financial_statement.at[idx, 'value'] - \
-                                                       financial_statement.loc[idx_list, 'value'].sum()
+    # only select current date and quarter
+    # quarterly data keeps the shortest period (single quarter), annual data the longest period (full year)
+    num = num.loc[
+        num.sort_values(by=["ddate", "qtrs"], ascending=(False, quarterly)).groupby(["adsh", "tag"]).cumcount() == 0]
 
-    # reset index
-    financial_statement = financial_statement.reset_index()
+    # create quarter and year column
+    if quarterly:
+        num['quarter'] = num['ddate'].dt.quarter
+    num['year'] = num['ddate'].dt.year
 
-    # only keep last 16 quarters
-    financial_statement['year-quarter'] = financial_statement['year'].astype(str) + 'Q' + financial_statement['quarter'].astype(str)
-    financial_statement = financial_statement.loc[financial_statement['year-quarter'].isin(quarters)]
+    # merge num and sub data
+    num = num.merge(sub)
 
-    financial_statement = financial_statement.drop(['index', 'adsh', 'ddate', 'qtrs', 'form'], axis=1)
-    # save as gzip file
-    financial_statement.to_parquet('./data/financial_statements.parquet.gzip', compression='gzip')
-    return financial_statement
+    # compact dtypes (categories for tag, name and ticker, small integers for cik, sic and year)
+    num = compact_dtypes(num)
+    return num
 
 
-def create_annual_data(tags):
+def transform_quarter(source, ticker, tags, memory_budget=None):
     """
+    Reads the sub and num file of one quarter once and creates the annual (10-K) and quarterly (10-K and 10-Q) data out
+    of it. Every quarter can be transformed independently.
+    :param source: name of the quarter folder or zip archive in ./data
+    :param ticker: mapping between cik and company ticker
     :param tags: parts of financial statement which should be considered
-    :return: returns annual data for all tags
+    :param memory_budget: approximate memory in bytes for reading one chunk of the num file
+    :return: dictionary with the annual and quarterly values of every statement and tag in that quarter
+    """
+    print(source)
+    # import data
+    with recorder.stage('read_sub', quarter=source) as record, open_quarter_file(source, 'sub.txt') as file:
+        sub = pd.read_csv(file, sep="\t", dtype={"cik": str})
+        record['rows'] = len(sub)
+    with recorder.stage('read_num', quarter=source) as record, open_quarter_file(source, 'num.txt') as file:
+        num = read_num(file, tags, memory_budget)
+        record['rows'] = len(num)
+
+    # transform sub data
+    # filter for needed columns
+    cols = ['adsh', 'cik', 'name', 'sic', 'form', 'filed', 'period', 'accepted', 'fy', 'fp']
+    sub = sub[cols]
+
+    # filter for quarterly and annual financial data
+    sub = sub[sub['form'].isin(['10-K', '10-Q'])]
+
+    # change to datetype
+    sub["accepted"] = pd.to_datetime(sub["accepted"])
+    sub["period"] = pd.to_datetime(sub["period"], format="%Y%m%d")
+    sub["filed"] = pd.to_datetime(sub["filed"], format="%Y%m%d")
+
+    # transform num data
+    # change to datetype
+    num["ddate"] = pd.to_datetime(num["ddate"], format="%Y%m%d")
+
+    with recorder.stage('select_statements', quarter=source) as record:
+        financial_statements = {
+            'annual': select_statements(sub[sub['form'] == '10-K'], num, ticker, quarterly=False),
+            'quarterly': select_statements(sub, num, ticker, quarterly=True),
+        }
+        record['rows'] = len(financial_statements['quarterly'])
+    return financial_statements
+
+
+def file_signature(path):
     """
+    :param path: path to the file
+    :return: size and modification time of the file, both change when the SEC replaces or edits a file
+    """
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
 
-    # final DataFrame
-    financial_statement = pd.DataFrame()
 
-    # get ticker data
-    ticker = pd.read_json('./data/ticker.txt').T
-    # transform ticker
-    ticker = ticker.drop(['title'], axis=1)
-    ticker.columns = ['cik', 'ticker']
-    ticker['cik'] = ticker['cik'].astype(str)
-    # drop companies with several tickers
-    ticker = ticker.drop_duplicates(subset='cik')
+def source_signature(source):
+    """
+    :param source: name of the quarter folder or zip archive in ./data
+    :return: signature of the zip archive or of the sub and num file in the folder
+    """
+    if source.endswith('.zip'):
+        return {source: file_signature(f'./data/{source}')}
+    return {file: file_signature(f'./data/{source}/{file}') for file in ['sub.txt', 'num.txt']}
+
+
+def load_manifest():
+    """
+    :return: manifest of the quarter folders that are already transformed and saved in the cache folder
+    """
+    if not os.path.exists(f'{cache_dir}/manifest.json'):
+        return {}
+    with open(f'{cache_dir}/manifest.json') as file:
+        return json.load(file)
+
+
+def save_manifest(manifest):
+    """
+    :param manifest: manifest of the quarter folders that are transformed and saved in the cache folder
+    """
+    with open(f'{cache_dir}/manifest.json', 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+
+def transform_quarters(sources, ticker, tags, workers=1, memory_budget=None):
+    """
+    Transforms the given quarters, in parallel by a process pool if there is more than one worker.
+    :param sources: names of the quarter folders or zip archives in ./data
+    :param ticker: mapping between cik and company ticker
+    :param tags: parts of financial statement which should be considered
+    :param workers: number of processes transforming the folders, 1 transforms them one after another
+    :param memory_budget: approximate memory in bytes for reading one chunk of a num file, per process
+    :return: list with the annual and quarterly data of every quarter in the order of the sources
+    """
+    if workers > 1 and len(sources) > 1:
+        # the stages of the workers are handed back with the results
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(collect, repeat(transform_quarter), sources, repeat(ticker), repeat(tags),
+                                        repeat(memory_budget)))
+        for _, records in results:
+            recorder.records.extend(records)
+        return [frame for frame, _ in results]
+    return [transform_quarter(source, ticker, tags, memory_budget) for source in sources]
+
+
+@recorder.timed
+def read_quarters(ticker, tags, workers=1, incremental=False, memory_budget=None):
+    """
+    Transforms all quarters in ./data and puts them together. The quarters are read from their extracted folders or
+    directly from the downloaded zip archives. Every quarter is only read once for the annual and the quarterly data.
+    The folders are transformed in parallel by a process pool and merged in the order of the quarter names, so the result
+    does not depend on the number of workers.
+    In incremental mode every transformed folder is saved in the cache folder and recorded in the manifest together with
+    the size and modification time of its files. Later runs only transform new or changed folders and read the rest from
+    the cache.
+    :param ticker: mapping between cik and company ticker
+    :param tags: parts of financial statement which should be considered
+    :param workers: number of processes transforming the folders, 1 transforms them one after another
+    :param incremental: True to only transform folders that are not in the manifest or changed since
+    :param memory_budget: approximate memory in bytes for reading one chunk of a num file, per process
+    :return: dictionary with the annual and the quarterly values of every statement and tag in all quarters
+    """
+    # iterate though all the quarters in data
+    sources = list_quarters()
+    folders = list(sources)
+
+    if not incremental:
+        frames = transform_quarters(list(sources.values()), ticker, tags, workers, memory_budget)
+        return {kind: concat_compact([frame[kind] for frame in frames]) for kind in ['annual', 'quarterly']}
+
+    os.makedirs(cache_dir, exist_ok=True)
+    processed = load_manifest()
 
-    # iterate though all the folders in data
-    for folder in os.listdir('./data'):
-        if folder.startswith("20"):
-            print(folder)
-            # import data
-            sub = pd.read_csv(f"./data/{folder}/sub.txt", sep="\t", dtype={"cik": str})
-            num = pd.read_csv(f"./data/{folder}/num.txt", sep="\t")
+    # every folder is merged with the ticker data and filtered for the tags
+    # --> new ticker data, other tags or a new transformation version mean all folders have to be transformed again
+    ticker_signature = file_signature('./data/ticker.txt')
+    if processed.get('ticker') != ticker_signature or processed.get('tags') != sorted(tags) or \
+            processed.get('version') != cache_version:
+        processed = {'ticker': ticker_signature, 'tags': sorted(tags), 'version': cache_version, 'folders': {}}
 
-            # transform sub data
-            # filter for needed columns
-            cols = ['adsh', 'cik', 'name', 'sic', 'form', 'filed', 'period', 'accepted', 'fy', 'fp']
-            sub = sub[cols]
+    # find new and changed folders
+    signatures = {folder: source_signature(source) for folder, source in sources.items()}
+    changed = [folder for folder in folders if processed['folders'].get(folder) != signatures[folder] or
+               not all(os.path.exists(f'{cache_dir}/{folder}_{kind}.parquet') for kind in ['annual', 'quarterly'])]
 
-            # change to datetype
-            sub["accepted"] = pd.to_datetime(sub["accepted"])
-            sub["period"] = pd.to_datetime(sub["period"], format="%Y%m%d")
-            sub["filed"] = pd.to_datetime(sub["filed"], format="%Y%m%d")
+    # transform new and changed folders and save them in the cache
+    frames = transform_quarters([sources[folder] for folder in changed], ticker, tags, workers, memory_budget)
+    for folder, frame in zip(changed, frames):
+        for kind in ['annual', 'quarterly']:
+            frame[kind].to_parquet(f'{cache_dir}/{folder}_{kind}.parquet')
+        processed['folders'][folder] = signatures[folder]
 
-            # filter for annual financial data
-            sub = sub[sub['form'] == '10-K']
+    # forget folders that were deleted from ./data
+    processed['folders'] = {folder: processed['folders'][folder] for folder in folders}
+    save_manifest(processed)
 
-            # delete duplicates --> company handed in same file in same period --> only keep newest
-            sub = sub.loc[sub.sort_values(by=["filed", "accepted"], ascending=False).groupby(["cik", "period"]).cumcount() == 0]
+    return {kind: concat_compact([pd.read_parquet(f'{cache_dir}/{folder}_{kind}.parquet') for folder in folders])
+            for kind in ['annual', 'quarterly']}
 
-            # drop not needed columns
-            sub = sub.drop(['filed', 'period', 'accepted', 'fy', 'fp'], axis=1)
 
-            # merge ticker and sub data
-            sub = sub.merge(ticker)
+def derive_q4(financial_statement):
+    """
+    Some companies only deliver full year numbers (qtrs = 4) in their annual report. For these the Q4 value is the full
+    year value minus the previous three quarters of the same company and tag. All companies and tags are calculated at
+    once with grouped shifts instead of filtering the whole DataFrame for every annual report.
+    :param financial_statement: quarterly data sorted by ddate
+    :return: DataFrame with Q4 values instead of full year values
+    """
+    group = financial_statement.groupby(['ticker', 'tag'], sort=False, observed=True)
+
+    # when form is 10-K --> annual report --> change to quarterly, only if there are 3 quarters before
+    full_year = ((financial_statement['form'] == '10-K') & (financial_statement['qtrs'] == 4) &
+                 (group.cumcount() >= 3)).to_numpy()
+    full_year_value = financial_statement['value'].to_numpy()
+
+    # a full year value can have another full year value in its last 3 quarters, which has to be changed first
+    # --> repeat until nothing changes, every round fixes at least one more full year value in such a chain
+    value = financial_statement['value']
+    while True:
+        previous = value.groupby([financial_statement['ticker'], financial_statement['tag']], sort=False, observed=True)
+        last_3_quarters = sum(previous.shift(i).fillna(0).to_numpy() for i in range(3, 0, -1))
+        new_value = np.where(full_year, full_year_value - last_3_quarters, full_year_value)
+        if np.array_equal(new_value, value.to_numpy(), equal_nan=True):
+            break
+        value = pd.Series(new_value, index=financial_statement.index)
+
+    financial_statement = financial_statement.copy()
+    financial_statement['value'] = value
+    return financial_statement
+
+
+@recorder.timed
+def build_quarterly_data(financial_statement, quarters):
+    """
+    Performs the steps across all quarters for the quarterly data and saves it.
+    :param financial_statement: quarterly values of every statement and tag in all quarters
+    :param quarters: quarters for which financial statement should be considered
+    :return: returns quarterly data for all tags and quarters
+    """
+    financial_statement = financial_statement.sort_values(by='ddate', kind='mergesort')
 
-            # transform num data
-            # change to datetype
-            num["ddate"] = pd.to_datetime(num["ddate"], format="%Y%m%d")
+    # create Q4 data
+    with recorder.stage('derive_q4', rows=len(financial_statement)):
+        financial_statement = derive_q4(financial_statement)
 
-            # filter for needed columns
-            cols_num = ['tag', 'adsh', 'ddate', 'qtrs', 'value']
-            num = num[cols_num]
+    # reset index
+    financial_statement = financial_statement.reset_index()
 
-            # only select current date and quarter
-            num = num.loc[num.sort_values(by=["ddate", "qtrs"], ascending=False).groupby(["adsh", "tag"]).cumcount() == 0]
+    # only keep last 16 quarters
+    financial_statement['year-quarter'] = financial_statement['year'].astype(str) + 'Q' + financial_statement['quarter'].astype(str)
+    financial_statement = financial_statement.loc[financial_statement['year-quarter'].isin(quarters)]
 
-            # create year column
-            num['year'] = num['ddate'].dt.year
+    financial_statement = financial_statement.drop(['index', 'adsh', 'ddate', 'qtrs', 'form'], axis=1)
+    for column in ['name', 'ticker']:
+        financial_statement[column] = financial_statement[column].cat.remove_unused_categories()
 
-            # merge num and sub data
-            num = num.merge(sub)
+    # save as dataset with one folder per year
+    with recorder.stage('save', rows=len(financial_statement)):
+        save_financials(financial_statement, 'quarterly')
+    return financial_statement
 
-            # append to financial statement
-            financial_statement = financial_statement.append(num)
 
-    # filter for needed tags
-    financial_statement = financial_statement[financial_statement.loc[:, 'tag'].isin(tags)]
-    financial_statement = financial_statement.sort_values(by='ddate')
+@recorder.timed
+def build_annual_data(financial_statement):
+    """
+    Performs the steps across all quarters for the annual data and saves it.
+    :param financial_statement: annual values of every statement and tag in all quarters
+    :return: returns annual data for all tags
+    """
+    financial_statement = financial_statement.sort_values(by='ddate', kind='mergesort')
 
     # only use firms with quarter 4 --> sign for full year
     #financial_statement = financial_statement[financial_statement.loc[:, 'qtrs'] == 4]
@@ -204,9 +393,17 @@ def create_annual_data(tags):
     # drop not needed columns
     financial_statement = financial_statement.drop(['index', 'adsh', 'ddate', 'qtrs', 'form'], axis=1)
 
+    # filing date of every company and year, the latest filing with values for that year
+    filed = financial_statement.groupby(['year', 'cik'])['filed'].max()
+
     # put tags into columns
-    financial_statement = pd.pivot_table(financial_statement, values='value', columns=['tag'],
-                                         index=['year', 'cik', 'name', 'sic', 'ticker']).reset_index()
+    with recorder.stage('pivot', rows=len(financial_statement)):
+        financial_statement = pd.pivot_table(financial_statement, values='value', columns=['tag'],
+                                             index=['year', 'cik', 'name', 'sic', 'ticker'], observed=True)
+    financial_statement.columns = financial_statement.columns.astype(str)
+    financial_statement = financial_statement.reset_index()
+    financial_statement.insert(5, 'filed', filed.reindex(
+        pd.MultiIndex.from_frame(financial_statement[['year', 'cik']])).to_numpy())
 
     # some companies have 2 annual statements, for example after merger --> drop these
     financial_statement = financial_statement.drop_duplicates(subset=['cik', 'year'], keep=False)
@@ -215,26 +412,83 @@ def create_annual_data(tags):
     financial_statement['IncomeTaxesPaid'] = financial_statement['IncomeTaxesPaid'].fillna(financial_statement['IncomeTaxesPaidNet'])
     financial_statement = financial_statement.drop(['IncomeTaxesPaidNet'], axis=1)
 
-    # save as gzip file
-    financial_statement.to_parquet('./data/financial_statements_annual.parquet.gzip', compression='gzip')
+    # compact dtypes, only keep categories of companies that are left
+    financial_statement = compact_dtypes(financial_statement)
+    for column in ['name', 'ticker']:
+        financial_statement[column] = financial_statement[column].cat.remove_unused_categories()
+
+    # save as dataset with one folder per year
+    with recorder.stage('save', rows=len(financial_statement)):
+        save_financials(financial_statement, 'annual')
     return financial_statement
 
 
+@recorder.timed
+def create_financial_data(quarters, tags, workers=1, incremental=False, memory_budget=None):
+    """
+    Creates the annual and the quarterly data in one pass over the quarters.
+    :param quarters: quarters for which financial statement should be considered
+    :param tags: parts of financial statement which should be considered
+    :param workers: number of processes transforming the quarter folders
+    :param incremental: True to only transform new or changed quarter folders and take the rest from the cache
+    :param memory_budget: approximate memory in bytes for reading one chunk of a num file, per process
+    :return: returns annual data and quarterly data for all tags
+    """
+    # get ticker data
+    ticker = load_ticker()
+
+    # transform all quarters, only the needed tags are read from the num files
+    financial_statements = read_quarters(ticker, tags, workers, incremental, memory_budget)
+
+    annual = build_annual_data(financial_statements['annual'])
+    quarterly = build_quarterly_data(financial_statements['quarterly'], quarters)
+    return annual, quarterly
+
+
+@recorder.timed
+def create_quarterly_data(quarters, tags, workers=1, incremental=False, memory_budget=None):
+    """
+    :param quarters: quarters for which financial statement should be considered
+    :param tags: parts of financial statement which should be considered
+    :param workers: number of processes transforming the quarter folders
+    :param incremental: True to only transform new or changed quarter folders and take the rest from the cache
+    :param memory_budget: approximate memory in bytes for reading one chunk of a num file, per process
+    :return: returns quarterly data for all tags and quarters
+    """
+    financial_statements = read_quarters(load_ticker(), tags, workers, incremental, memory_budget)
+    return build_quarterly_data(financial_statements['quarterly'], quarters)
+
+
+@recorder.timed
+def create_annual_data(tags, workers=1, incremental=False, memory_budget=None):
+    """
+    :param tags: parts of financial statement which should be considered
+    :param workers: number of processes transforming the quarter folders
+    :param incremental: True to only transform new or changed quarter folders and take the rest from the cache
+    :param memory_budget: approximate memory in bytes for reading one chunk of a num file, per process
+    :return: returns annual data for all tags
+    """
+    financial_statements = read_quarters(load_ticker(), tags, workers, incremental, memory_budget)
+    return build_annual_data(financial_statements['annual'])
+
+
 def create_ticker(year):
     """
     :param year: year which should be considered
     :return: Take the annual statement data and extract the companies which handed in their annual report at the SEC
     """
-    df = pd.read_parquet('./data/financial_statements_annual.parquet.gzip')
-    df = df[['year', 'ticker']]
-    df = df[df.loc[:, 'year'] == year]
+    df = load_financials(columns=['year', 'ticker'], years=(year, year))
     ticker = df['ticker'].tolist()
     return ticker
 
 
-def get_stock_returns(year):
+@recorder.timed
+def get_stock_returns(year, provider=None, workers=8):
     """
+    Prices already in the price store (./data/prices) are not requested again, only the missing days.
     :param year: year which should be considered
+    :param provider: price provider, None for Yahoo Finance
+    :param workers: number of concurrent price requests
     :return: for a given year, get the stock prices for the last 5 years for each company that handed in their
             annual data at the SEC
     """
@@ -242,28 +496,20 @@ def get_stock_returns(year):
     start_date = str(year-4) + '-01-01'
     ticker = create_ticker(year)
 
-    df_prices = pd.DataFrame()
-
-    # get price data for every stock
-    for stock in ticker:
-        print(stock)
-        tick = yf.Ticker(stock)
-
-        # get historical market data
-        hist = tick.history(start=start_date)
-        df_prices = df_prices.join(hist['Close'], how='outer', rsuffix=stock)
-
-    df_prices.columns = ticker
+    # get missing price data for every stock and the market index and put the price matrix together
+    store = PriceStore(provider=provider)
+    store.update(ticker + [market_index_ticker], start_date, workers=workers)
+    df_prices = store.prices(ticker, start=start_date)
 
     # in the case a price is missing for one stock, fill with NA
     df_prices[df_prices.loc[:, :] == ""] = np.nan
 
-    df_prices.to_parquet('./data/stock_returns.parquet.gzip', compression='gzip')
+    df_prices.to_parquet(stock_returns_file, compression='gzip')
     return df_prices
 
 
-#create_annual_data(tags)
+#create_financial_data(quarters, tags, workers, incremental=True, memory_budget=memory_budget)
 #get_stock_returns(year)
-#create_quarterly_data(quarters, tags)
-#df =pd.read_parquet('./data/financial_statements_annual.parquet.gzip')
+#recorder.export_json_lines('./data/stages.jsonl')
+#df = load_financials()
 #df.to_excel('annuals.xlsx')
\ No newline at end of file
@@ -0,0 +1,372 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from instrumentation import recorder
+from prices import PriceStore, period_returns, price_store_dir
+
+# compact dtypes for the financial statement data, both for the long data during the ingestion (one row per statement
+# and tag) and the final annual and quarterly data
+# - cik (max. 7 digits), sic (4 digits, missing for some companies), year and quarter fit into small integers
+# - ticker, name and tag repeat in every row --> categories only save every value once
+schema = {
+    'cik': 'int32',
+    'sic': 'Int16',
+    'year': 'int16',
+    'quarter': 'int8',
+    'ticker': 'category',
+    'name': 'category',
+    'tag': 'category',
+}
+
+# annual and quarterly financial statement data, saved as parquet datasets with one folder per year
+# (p.e. ./data/financial_statements_annual/year=2020/) --> reading a few years only opens the files of these years
+financial_statement_datasets = {
+    'annual': './data/financial_statements_annual',
+    'quarterly': './data/financial_statements',
+}
+
+# single gzip files of older versions, only used if there is no dataset
+financial_statement_files = {
+    'annual': './data/financial_statements_annual.parquet.gzip',
+    'quarterly': './data/financial_statements.parquet.gzip',
+}
+
+# zstd decompresses several times faster than gzip at a similar file size
+compression = 'zstd'
+
+# daily close prices of all stocks (one column per ticker)
+stock_returns_file = './data/stock_returns.parquet.gzip'
+
+# monthly and weekly returns of all stocks, created out of the daily close prices
+period_returns_files = {
+    'M': './data/monthly_returns.parquet.gzip',
+    'W': './data/weekly_returns.parquet.gzip',
+}
+
+
+def compact_dtypes(df, float32=False):
+    """
+    Changes the columns of the financial statement data to the compact dtypes of the schema.
+    :param df: financial statement data
+    :param float32: True to also store the values in 32 bit floats (approx. 7 significant digits)
+    :return: DataFrame with compact dtypes
+    """
+    dtypes = {column: dtype for column, dtype in schema.items() if column in df.columns and df[column].dtype != dtype}
+    if float32:
+        dtypes.update({column: 'float32' for column in df.columns if df[column].dtype == 'float64'})
+    return df.astype(dtypes)
+
+
+def concat_compact(frames):
+    """
+    Puts DataFrames with compact dtypes together. A plain concat turns categories into objects as soon as the frames
+    have different categories, here the categories are united first.
+    :param frames: list of DataFrames with compact dtypes
+    :return: DataFrame with compact dtypes
+    """
+    frames = [frame for frame in frames if len(frame.columns) > 0]
+    if not frames:
+        return pd.DataFrame()
+
+    for column in frames[0].columns:
+        if all(isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames):
+            categories = union_categoricals([frame[column] for frame in frames], sort_categories=True).categories
+            frames = [frame.assign(**{column: frame[column].cat.set_categories(categories)}) for frame in frames]
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def memory_report(df, float32=False, path=None):
+    """
+    Measures the memory of the financial statement data with its current dtypes and with the compact dtypes.
+    :param df: financial statement data
+    :param float32: True to also store the values in 32 bit floats
+    :param path: optional path of a parquet file of the data to compare the file size
+    :return: DataFrame with dtype and memory in MB for every column, the last row is the total
+    """
+    compact = compact_dtypes(df, float32)
+    report = pd.DataFrame({
+        'dtype': df.dtypes.astype(str),
+        'compact_dtype': compact.dtypes.astype(str),
+        'memory': df.memory_usage(deep=True, index=False) / 1024 ** 2,
+        'compact_memory': compact.memory_usage(deep=True, index=False) / 1024 ** 2,
+    })
+    report.loc['total'] = ['', '', report['memory'].sum(), report['compact_memory'].sum()]
+    report['ratio'] = report['memory'] / report['compact_memory']
+
+    # size on disk
+    if path is not None:
+        compact_path = f'{path}.compact'
+        compact.to_parquet(compact_path, compression='gzip')
+        report.loc['file'] = ['', '', os.path.getsize(path) / 1024 ** 2, os.path.getsize(compact_path) / 1024 ** 2,
+                              os.path.getsize(path) / os.path.getsize(compact_path)]
+        os.remove(compact_path)
+    return report
+
+
+def save_financials(df, kind):
+    """
+    Saves the annual or quarterly financial statement data as a dataset partitioned by year.
+    :param df: financial statement data
+    :param kind: 'annual' or 'quarterly'
+    """
+    path = financial_statement_datasets[kind]
+    # remove the old dataset, else files of the old and new data end up in the same year folders
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    df.to_parquet(path, partition_cols=['year'], compression=compression, index=False)
+
+
+def financial_years(kind='annual'):
+    """
+    :param kind: 'annual' or 'quarterly'
+    :return: sorted list of the years in the financial statement data
+    """
+    path = financial_statement_datasets[kind]
+    if os.path.isdir(path):
+        return sorted(int(folder[len('year='):]) for folder in os.listdir(path) if folder.startswith('year='))
+    return sorted(pd.read_parquet(financial_statement_files[kind], columns=['year'])['year'].unique().tolist())
+
+
+def latest_years(available_years, last_years, as_of=None):
+    """
+    :param available_years: years in the financial statement data
+    :param last_years: number of latest years
+    :param as_of: date for which the latest years are needed, None for today
+    :return: tuple with first and last year (None for no limit) of the latest years up to the year of the date, a
+             first year after the last year (no years) if no year is available up to the date
+    """
+    # years in the future are typos in the filings and no sign for the latest year
+    current_year = pd.Timestamp(as_of).year if as_of is not None else pd.Timestamp.today().year
+    latest_year = max((year for year in available_years if year <= current_year), default=None)
+    # date before the first filed year --> empty data instead of an error
+    if latest_year is None:
+        return current_year + 1, current_year
+    return latest_year - last_years + 1, None
+
+
+def filing_dates(df):
+    """
+    :param df: financial statement data
+    :return: array with the date from which on every statement was known, the filing date (data of older versions
+             without filing dates: end of March of the following year)
+    """
+    if 'filed' in df.columns:
+        return df['filed'].to_numpy()
+    return pd.to_datetime(pd.DataFrame({'year': df['year'].astype(int) + 1, 'month': 3, 'day': 31})).to_numpy()
+
+
+def load_financials(kind='annual', columns=None, years=None, last_years=None, float32=False):
+    """
+    Loads the annual or quarterly financial statement data with compact dtypes. Only the requested columns and years are
+    read: columns are selected in the parquet files and years by their folders in the dataset.
+    :param kind: 'annual' or 'quarterly'
+    :param columns: list of the needed columns, None for all columns
+    :param years: tuple with first and last year (inclusive, None for no limit), None for all years
+    :param last_years: number of latest years to load (up to the current year), instead of years
+    :param float32: True to load the values as 32 bit floats
+    :return: DataFrame with the financial statement data
+    """
+    path = financial_statement_datasets[kind]
+    if not os.path.isdir(path):
+        path = financial_statement_files[kind]
+
+    if last_years is not None:
+        years = latest_years(financial_years(kind), last_years)
+
+    # filter years
+    filters = []
+    if years is not None:
+        first_year, last_year = years
+        if first_year is not None:
+            filters.append(('year', '>=', first_year))
+        if last_year is not None:
+            filters.append(('year', '<=', last_year))
+
+    df = pd.read_parquet(path, columns=columns, filters=filters or None)
+
+    # the dataset returns the year (folder name) as last column --> back to the order of the columns
+    if columns is None:
+        columns = ['year'] + [column for column in df.columns if column != 'year']
+    return compact_dtypes(df[columns], float32)
+
+
+def data_signature(path):
+    """
+    :param path: path of a file or a dataset folder
+    :return: size and modification time of the file or of every file in the folder, None if the path does not exist
+    """
+    if os.path.isfile(path):
+        paths = [path]
+    elif os.path.isdir(path):
+        paths = sorted(os.path.join(folder, file) for folder, _, files in os.walk(path) for file in files)
+    else:
+        return None
+    return [(file, os.stat(file).st_size, os.stat(file).st_mtime_ns) for file in paths]
+
+
+class DataContext:
+    """
+    Keeps the financial statement data and the stock prices in memory, so every file is only read and decompressed once
+    for all strategies. A file is read again as soon as its size or modification time changes.
+    The strategies get their own copy of the requested columns and years of the financial statement data and a
+    read-only view of the prices (changing the prices in place raises an error, new DataFrames are not affected).
+    """
+
+    def __init__(self):
+        # name of the data --> (signature of the file, data)
+        self.cache = {}
+
+    def _load(self, name, path, loader):
+        """
+        :param name: name of the data in the cache
+        :param path: path of the file or dataset folder
+        :param loader: function that reads the data
+        :return: data out of the cache, read again if the file changed
+        """
+        signature = data_signature(path)
+        if name not in self.cache or self.cache[name][0] != signature:
+            with recorder.stage('load', data=name) as record:
+                self.cache[name] = (signature, loader())
+                if hasattr(self.cache[name][1], 'shape'):
+                    record['rows'] = len(self.cache[name][1])
+        return self.cache[name][1]
+
+    def financials(self, kind='annual', columns=None, years=None, last_years=None, float32=False, as_of=None):
+        """
+        Same as load_financials, the whole data is only read once.
+        :param kind: 'annual' or 'quarterly'
+        :param columns: list of the needed columns, None for all columns
+        :param years: tuple with first and last year (inclusive, None for no limit), None for all years
+        :param last_years: number of latest years to load (up to the current year or the year of as_of), instead of
+                           years
+        :param float32: True to return the values as 32 bit floats
+        :param as_of: only statements filed until this date (no look-ahead), None for all statements
+        :return: DataFrame with the financial statement data
+        """
+        path = financial_statement_datasets[kind]
+        if not os.path.isdir(path):
+            path = financial_statement_files[kind]
+        df = self._load(f'financials_{kind}', path, lambda: load_financials(kind))
+
+        # filter statements known at the date
+        mask = np.ones(len(df), dtype=bool)
+        if as_of is not None:
+            mask &= filing_dates(df) <= np.datetime64(pd.Timestamp(as_of))
+
+        if last_years is not None:
+            years = latest_years(df['year'][mask].unique(), last_years, as_of)
+
+        # filter years
+        if years is not None:
+            first_year, last_year = years
+            if first_year is not None:
+                mask &= (df['year'] >= first_year).to_numpy()
+            if last_year is not None:
+                mask &= (df['year'] <= last_year).to_numpy()
+
+        df = df.loc[mask, columns if columns is not None else df.columns].reset_index(drop=True)
+        return compact_dtypes(df, float32)
+
+    def period_returns(self, freq='M', as_of=None):
+        """
+        Monthly or weekly returns of all stocks. They are saved next to the prices and only created again when the
+        prices are newer than the saved returns.
+        :param freq: 'M' for monthly, 'W' for weekly returns
+        :param as_of: only returns until this date, the period of the date only with its returns until the date, None
+                      for all returns
+        :return: read-only DataFrame with the return of every period, one column per ticker
+        """
+        def load():
+            path = period_returns_files[freq]
+            if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(stock_returns_file):
+                period_returns(self.stock_prices(), freq).to_parquet(path, compression='gzip')
+            return read_only(pd.read_parquet(path))
+
+        # depends on the prices --> read again as soon as the prices change
+        df = view(self._load(f'returns_{freq}', stock_returns_file, load))
+        if as_of is None:
+            return df
+
+        # complete periods until the date
+        df = until(df, as_of)
+        prices = self.stock_prices(as_of)
+        if len(df) < 2 or prices.index[-1] <= df.index[-1]:
+            return df
+
+        # returns of the period of the date, out of the prices since the end of the period before the last complete one
+        last = period_returns(prices[prices.index > df.index[-2]], freq)
+        return pd.concat([df, last[last.index > df.index[-1]]])
+
+    def stock_prices(self, as_of=None):
+        """
+        :param as_of: only prices until this date, None for all prices
+        :return: read-only DataFrame with the daily close prices, one column per ticker
+        """
+        df = view(self._load('stock_prices', stock_returns_file,
+                             lambda: read_only(pd.read_parquet(stock_returns_file))))
+        return until(df, as_of) if as_of is not None else df
+
+    def daily_returns(self, as_of=None):
+        """
+        :param as_of: only returns until this date, None for all returns
+        :return: read-only DataFrame with the daily returns, one column per ticker (calculated once out of all prices,
+                 the returns until a date are the same as the returns of the prices until the date)
+        """
+        df = view(self._load('daily_returns', stock_returns_file,
+                             lambda: read_only(self.stock_prices().pct_change())))
+        return until(df, as_of) if as_of is not None else df
+
+    def stored_prices(self, tickers, start=None, as_of=None):
+        """
+        Close prices out of the price store (see prices.PriceStore), p.e. of the market index. Nothing is downloaded.
+        :param tickers: list of tickers
+        :param start: first date, None for all dates
+        :param as_of: only prices until this date, None for all prices
+        :return: DataFrame with the close prices, one column per ticker (all NA if the ticker is not in the store)
+        """
+        # the price matrix of the tickers is only created once, every date only cuts it
+        path = f'{price_store_dir}/prices.parquet'
+        df = view(self._load(f'stored_prices_{",".join(tickers)}_{start}', path,
+                             lambda: read_only(self._load('price_store', path, lambda: PriceStore(price_store_dir))
+                                               .prices(tickers, start=start).astype(float))))
+        return until(df, as_of) if as_of is not None else df
+
+
+def until(df, as_of):
+    """
+    :param df: DataFrame with dates as index, sorted
+    :param as_of: last date
+    :return: rows until the date (a slice, read-only data stays read-only)
+    """
+    as_of = pd.Timestamp(as_of)
+    if df.index.tz is not None and as_of.tz is None:
+        as_of = as_of.tz_localize(df.index.tz)
+    return df.iloc[:df.index.searchsorted(as_of, side='right')]
+
+
+def read_only(df):
+    """
+    :param df: DataFrame with one dtype, p.e. prices
+    :return: DataFrame on a read-only array with the same values
+    """
+    values = df.to_numpy(copy=True)
+    values.flags.writeable = False
+    return pd.DataFrame(values, index=df.index, columns=df.columns, copy=False)
+
+
+def view(df):
+    """
+    :param df: DataFrame in the cache
+    :return: DataFrame on the same values, new columns or new index names do not end up in the cache
+    """
+    df = df.copy(deep=False)
+    df.index = df.index.copy()
+    df.columns = df.columns.copy()
+    return df
+
+
+# shared by all strategies
+data_context = DataContext()
@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+
+
+class CompanyPanel:
+    """
+    Lags, deltas, averages and growth rates of the statements of every company. The rows are sorted by company and year
+    once, afterwards every feature is calculated on whole columns without a loop over the companies. The previous value
+    of a row is the value of the previous statement of the same company, the first statement of a company has none.
+    All features are returned in the row order of the data.
+    """
+
+    def __init__(self, df, company='cik', time='year'):
+        """
+        :param df: financial statement data, one row per company and year
+        :param company: column with the company
+        :param time: column with the year
+        """
+        self.index = df.index
+        # stable sort --> rows with the same company and year keep their order
+        self.order = np.lexsort((df[time].to_numpy(), df[company].to_numpy()))
+        companies = df[company].to_numpy()[self.order]
+
+        # first row of every company and position of that row for every row
+        self.first = np.ones(len(df), dtype=bool)
+        self.first[1:] = companies[1:] != companies[:-1]
+        self.start = np.maximum.accumulate(np.where(self.first, np.arange(len(df)), 0))
+
+    def _sorted(self, values):
+        """
+        :param values: column of the data (Series or array in the row order of the data)
+        :return: float array sorted by company and year
+        """
+        values = np.asarray(values)
+        if values.dtype.kind != 'f':
+            values = values.astype(float)
+        return values[self.order]
+
+    def _restore(self, values):
+        """
+        :param values: array sorted by company and year
+        :return: array in the row order of the data
+        """
+        result = np.empty_like(values)
+        result[self.order] = values
+        return result
+
+    def _previous(self, values):
+        """
+        :param values: array sorted by company and year
+        :return: array with the previous value of the same company, NaN for the first statement
+        """
+        previous = np.empty_like(values)
+        previous[1:] = values[:-1]
+        previous[self.first] = np.nan
+        return previous
+
+    def lag(self, values):
+        """
+        :param values: column of the data
+        :return: value of the previous statement
+        """
+        return self._restore(self._previous(self._sorted(values)))
+
+    def delta(self, values):
+        """
+        :param values: column of the data
+        :return: change since the previous statement
+        """
+        values = self._sorted(values)
+        return self._restore(values - self._previous(values))
+
+    def average(self, values):
+        """
+        :param values: column of the data
+        :return: average of the value and the value of the previous statement
+        """
+        values = self._sorted(values)
+        return self._restore((values + self._previous(values)) / 2)
+
+    def pct_change(self, values):
+        """
+        Same as groupby(company).pct_change(): missing values are filled with the last value of the same company first.
+        :param values: column of the data
+        :return: growth rate since the previous statement
+        """
+        values = self._sorted(values)
+
+        # position of the last available value, only within the same company
+        position = np.maximum.accumulate(np.where(np.isnan(values), -1, np.arange(len(values))))
+        filled = np.where(position >= self.start, values[np.maximum(position, 0)], np.nan)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self._restore(filled / self._previous(filled) - 1)
+
+    def expanding_std(self, values):
+        """
+        Same as groupby(company).expanding().std(): standard deviation of all statements of the company up to the
+        statement (missing values are left out, NaN with less than 2 values). The standard deviation of the latest
+        statement is the one of all statements of the company.
+        :param values: column of the data
+        :return: standard deviation of the statements until the statement
+        """
+        values = self._sorted(values)
+        valid = ~np.isnan(values)
+
+        # cumulative sums that start again at the first statement of every company
+        sums = []
+        for summand in [valid.astype(float), np.where(valid, values, 0), np.where(valid, values * values, 0)]:
+            cumulative = np.cumsum(summand)
+            sums.append(cumulative - (cumulative - summand)[self.start])
+        count, total, squares = sums
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variance = (squares - total * total / count) / (count - 1)
+        std = np.sqrt(np.maximum(variance, 0))
+        return self._restore(np.where(count > 1, std, np.nan))
+
+    def features(self, df, lags=None, deltas=None, averages=None, pct_changes=None):
+        """
+        Calculates several features at once.
+        :param df: financial statement data the panel was created with
+        :param lags: dict with name of the new column and column of the data, p.e. {'assets_begin': 'Assets'}
+        :param deltas: dict with name of the new column and column of the data
+        :param averages: dict with name of the new column and column of the data
+        :param pct_changes: dict with name of the new column and column of the data
+        :return: DataFrame with the new columns and the index of the data
+        """
+        features = {}
+        for requested, feature in [(lags, self.lag), (deltas, self.delta), (averages, self.average),
+                                   (pct_changes, self.pct_change)]:
+            for name, column in (requested or {}).items():
+                features[name] = feature(df[column])
+        return pd.DataFrame(features, index=self.index)
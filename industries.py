@@ -0,0 +1,97 @@
+import numpy as np
+
+# digits of the SIC levels: 2 = major group, 3 = industry group, 4 = industry
+sic_levels = [2, 3, 4]
+
+# minimum number of companies of an industry for a comparison with its median
+industry_min_size = 5
+
+
+def industry_codes(sic, digits):
+    """
+    :param sic: array with the 4-digit SIC codes as numbers (NaN for a missing code)
+    :param digits: number of digits of the level, 2, 3 or 4
+    :return: integer array with the code of the level (p.e. 2834 --> 28 for 2 digits), -1 for a missing code
+    """
+    sic = np.asarray(sic, dtype=float)
+    return np.where(np.isnan(sic), -1, sic // 10 ** (4 - digits)).astype(np.int64)
+
+
+def industry_stats(values, sic, levels=None, groups=None):
+    """
+    Medians of all columns and number of companies in the industry of every row for several SIC levels at once.
+    The rows are sorted once by group and 4-digit code, the industries of the coarser levels are consecutive runs of
+    that order too. Every level then only needs one sort of all columns by industry and value: the median of an
+    industry is the middle of its run. Missing values are left out of the medians, rows without SIC code get no
+    industry (NaN medians, size 0).
+    :param values: 2D float array (rows x columns) with the measures
+    :param sic: array with the 4-digit SIC codes as numbers (NaN for a missing code)
+    :param levels: list with the digits of the levels, None for sic_levels
+    :param groups: integer array with a further group of every row, p.e. the year (industries of the same year only)
+    :return: dict with the digits of every level and tuple of two arrays: median of the industry of every row (rows x
+             columns) and size of the industry of every row
+    """
+    levels = levels if levels is not None else sic_levels
+    values = np.asarray(values, dtype=float)
+    missing = np.isnan(np.asarray(sic, dtype=float))
+    groups = np.zeros(len(sic), dtype=np.int64) if groups is None else np.asarray(groups, dtype=np.int64)
+    if len(sic) == 0:
+        return {digits: (np.full(values.shape, np.nan), np.zeros(0, dtype=np.int64)) for digits in levels}
+
+    # one sort by group and 4-digit code for all levels, every column sorted by value once (missing values last)
+    order = np.lexsort((industry_codes(sic, 4), groups))
+    sorted_groups = groups[order]
+    value_order = np.argsort(values, axis=0, kind='stable')
+    positions = np.arange(len(order))
+
+    stats = {}
+    for digits in levels:
+        # industry of every row: number of the run of equal group and code in the sorted order
+        codes = industry_codes(sic, digits)[order]
+        new = np.ones(len(order), dtype=bool)
+        new[1:] = (codes[1:] != codes[:-1]) | (sorted_groups[1:] != sorted_groups[:-1])
+        industry = np.empty(len(order), dtype=np.int64)
+        industry[order] = np.cumsum(new) - 1
+        starts = positions[new]
+        sizes = np.diff(np.append(starts, len(order)))
+
+        # every column sorted by industry and within the industry by value
+        by_industry = np.take_along_axis(value_order,
+                                         np.argsort(industry[value_order], axis=0, kind='stable'), axis=0)
+        sorted_values = np.take_along_axis(values, by_industry, axis=0)
+
+        # middle of the valid values of every industry
+        valid = np.add.reduceat(~np.isnan(sorted_values), starts, axis=0)
+        lower = np.take_along_axis(sorted_values, starts[:, None] + np.maximum(valid - 1, 0) // 2, axis=0)
+        upper = np.take_along_axis(sorted_values, starts[:, None] + valid // 2, axis=0)
+        medians = np.where(valid > 0, (lower + upper) / 2, np.nan)
+
+        row_medians, row_sizes = medians[industry], sizes[industry]
+        row_medians[missing], row_sizes[missing] = np.nan, 0
+        stats[digits] = row_medians, row_sizes
+    return stats
+
+
+def industry_medians(values, sic, digits=2, fallback=False, min_size=industry_min_size, groups=None):
+    """
+    Medians of all columns within the industry of every row. With fallback, a row of an industry with less than
+    min_size companies is compared with the next coarser level instead (p.e. 4 --> 3 --> 2 digits).
+    :param values: 2D float array (rows x columns) with the measures
+    :param sic: array with the 4-digit SIC codes as numbers (NaN for a missing code)
+    :param digits: number of digits of the industries, 2, 3 or 4
+    :param fallback: True to fall back to coarser levels for small industries
+    :param min_size: minimum number of companies of an industry (only used with fallback)
+    :param groups: integer array with a further group of every row, p.e. the year
+    :return: tuple of three arrays: median of the industry of every row (rows x columns), size of the industry and
+             digits of the level that was used
+    """
+    levels = [level for level in sic_levels if level <= digits] if fallback else [digits]
+    stats = industry_stats(values, sic, levels, groups)
+    medians, sizes = stats[digits]
+    used = np.full(len(sizes), digits)
+
+    # from the finest to the coarsest level, only rows that are still too small move on
+    for level in sorted(levels, reverse=True)[1:]:
+        small = sizes < min_size
+        medians[small], sizes[small], used[small] = stats[level][0][small], stats[level][1][small], level
+    return medians, sizes, used
@@ -0,0 +1,233 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows --> no peak memory
+    resource = None
+
+
+def peak_rss():
+    """
+    :return: peak resident memory of the process since its start or since the last reset_peak_rss in bytes, None if
+             the platform does not tell
+    """
+    # Linux: high-water mark of the process that reset_peak_rss can set back
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def reset_peak_rss():
+    """
+    Sets the peak resident memory of the process back to its current resident memory (Linux only), so the peak of a
+    stage is not the peak of an earlier stage.
+    :return: True if the peak was reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class StageRecorder:
+    """
+    Records wall time, CPU time, peak resident memory and number of rows of named stages, p.e. the parsing of the num
+    files or the ranking of a strategy. A stage only reads the clocks and the memory of the process at its start and
+    end (a few microseconds), so the recorder can stay on in production. The peak of the process is reset at the start
+    of every stage (Linux), so the increase of the peak over the memory at the start belongs to the stage. On other
+    platforms the peak is the peak since the start of the process and the increase is only the part above earlier
+    peaks.
+    Stages can be nested, the name of a nested stage contains the names of the stages around it
+    (p.e. equity_pairs/correlation). Stages in worker processes are handed to the main process with collect.
+    """
+
+    def __init__(self, enabled=True):
+        """
+        :param enabled: False to record nothing
+        """
+        self.enabled = enabled
+        self.records = []
+        self.stack = []
+        # highest peak of every open stage so far, a nested stage resets the peak of the process
+        self.peaks = []
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """
+        Records the code in the with block as a stage:
+        with recorder.stage('read_num', quarter='2021q1') as record:
+            num = ...
+            record['rows'] = len(num)
+        :param name: name of the stage
+        :param labels: further information of the stage, p.e. the quarter, rows for the number of rows if it is known
+                       at the start
+        :return: dict with the record of the stage, the number of rows can be set in the with block
+        """
+        if not self.enabled:
+            yield {}
+            return
+
+        # the peak so far belongs to the open stages before it is reset
+        self.peaks = [max_known(peak, peak_rss()) for peak in self.peaks]
+        reset_peak_rss()
+        start_rss = peak_rss()
+        self.stack.append(name)
+        self.peaks.append(start_rss)
+        record = {'stage': '/'.join(self.stack), 'rows': None, **labels, 'start': time.time()}
+        start, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        except BaseException as error:
+            record['error'] = type(error).__name__
+            raise
+        finally:
+            self.stack.pop()
+            record['wall_time'] = time.perf_counter() - start
+            record['cpu_time'] = time.process_time() - start_cpu
+            peak = max_known(self.peaks.pop(), peak_rss())
+            # the stages around it had the same peak
+            self.peaks = [max_known(outer, peak) for outer in self.peaks]
+            record['peak_rss'] = peak
+            record['peak_rss_increase'] = peak - start_rss if peak is not None else None
+            record['pid'] = os.getpid()
+            self.records.append(record)
+
+    def timed(self, function):
+        """
+        Decorator that records every call of a function as a stage with the name of the function. The rows are the
+        length of the result if it is a DataFrame, Series or array.
+        :param function: function to record
+        :return: decorated function
+        """
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with self.stage(function.__name__) as record:
+                result = function(*args, **kwargs)
+                if hasattr(result, 'shape'):
+                    record['rows'] = len(result)
+            return result
+        return wrapper
+
+    def collect(self, function, *args, **kwargs):
+        """
+        Runs a function and returns its result together with the records of its stages, p.e. in a worker process.
+        The main process adds the records to its own recorder (recorder.records.extend(records)).
+        :param function: function to run
+        :return: tuple of the result and the list of the new records
+        """
+        first = len(self.records)
+        result = function(*args, **kwargs)
+        records = self.records[first:]
+        del self.records[first:]
+        return result, records
+
+    def clear(self):
+        """
+        Forgets all records.
+        """
+        self.records = []
+
+    def export_json_lines(self, path, append=True):
+        """
+        Writes every record as one JSON line.
+        :param path: path of the file
+        :param append: True to append to an existing file, p.e. one file for all nightly runs
+        """
+        with open(path, 'a' if append else 'w') as file:
+            for record in self.records:
+                file.write(json.dumps(record) + '\n')
+
+    def export_prometheus(self, path, prefix='stage'):
+        """
+        Writes the records in the text format of Prometheus (p.e. for the textfile collector of the node exporter).
+        Records of the same stage and labels are added up (peak memory: maximum), the file is replaced at once so a
+        collector never reads half a file.
+        :param path: path of the file (.prom)
+        :param prefix: prefix of the metric names
+        """
+        metrics = {}
+        for record in self.records:
+            labels = tuple(sorted((key, str(value)) for key, value in record.items() if key not in
+                                  ['rows', 'start', 'wall_time', 'cpu_time', 'peak_rss', 'peak_rss_increase', 'pid',
+                                   'error']))
+            metric = metrics.setdefault(labels, {'runs': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'rows': 0,
+                                                 'peak_rss_bytes': 0, 'peak_rss_increase_bytes': 0, 'errors': 0})
+            metric['runs'] += 1
+            metric['wall_seconds'] += record['wall_time']
+            metric['cpu_seconds'] += record['cpu_time']
+            metric['rows'] += record['rows'] or 0
+            metric['peak_rss_bytes'] = max(metric['peak_rss_bytes'], record['peak_rss'] or 0)
+            metric['peak_rss_increase_bytes'] = max(metric['peak_rss_increase_bytes'],
+                                                    record.get('peak_rss_increase') or 0)
+            metric['errors'] += 'error' in record
+
+        descriptions = {
+            'runs': 'number of runs of the stage',
+            'wall_seconds': 'wall time of the stage',
+            'cpu_seconds': 'CPU time of the stage',
+            'rows': 'number of rows of the stage',
+            'peak_rss_bytes': 'peak resident memory of the process during the stage',
+            'peak_rss_increase_bytes': 'increase of the peak resident memory over the memory at the start of the stage',
+            'errors': 'number of runs of the stage that raised an error',
+        }
+        lines = []
+        for name, description in descriptions.items():
+            lines.append(f'# HELP {prefix}_{name} {description}')
+            lines.append(f'# TYPE {prefix}_{name} gauge')
+            for labels, metric in metrics.items():
+                label_text = ','.join(f'{key}="{escape_label(value)}"' for key, value in labels)
+                lines.append(f'{prefix}_{name}{{{label_text}}} {metric[name]}')
+
+        with open(f'{path}.tmp', 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        os.replace(f'{path}.tmp', path)
+
+
+def max_known(first, second):
+    """
+    :param first: memory in bytes or None if unknown
+    :param second: memory in bytes or None if unknown
+    :return: larger of the known values, None if both are unknown
+    """
+    known = [value for value in [first, second] if value is not None]
+    return max(known) if known else None
+
+
+def escape_label(value):
+    """
+    :param value: value of a Prometheus label
+    :return: value with escaped backslashes, quotes and line breaks
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# shared recorder of all stages of the process
+recorder = StageRecorder()
+
+
+def collect(function, *args, **kwargs):
+    """
+    Same as recorder.collect for the recorder of the process that runs it, p.e. executor.submit(collect, function, ...)
+    to get the records of a worker process.
+    :param function: function to run
+    :return: tuple of the result and the list of the new records
+    """
+    return recorder.collect(function, *args, **kwargs)
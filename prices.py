@@ -0,0 +1,265 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+
+class YahooPriceProvider:
+    """
+    Downloads daily close prices from Yahoo Finance.
+    """
+
+    def history(self, ticker, start, end=None):
+        """
+        :param ticker: stock ticker
+        :param start: first date, p.e. '2017-01-01'
+        :param end: last date (exclusive), None for today
+        :return: Series with the close price for every trading day, empty if Yahoo has no data for the ticker
+        """
+        hist = yf.Ticker(ticker).history(start=start, end=end)
+        if 'Close' not in hist:
+            return pd.Series(dtype=float)
+        return hist['Close']
+
+
+class LocalPriceProvider:
+    """
+    Serves close prices from a DataFrame (date x ticker), p.e. a saved stock_returns file. Stands in for Yahoo Finance
+    to run the price loading offline.
+    """
+
+    def __init__(self, prices):
+        """
+        :param prices: DataFrame with the close prices, one column per ticker
+        """
+        self.prices = prices
+
+    def history(self, ticker, start, end=None):
+        """
+        :param ticker: stock ticker
+        :param start: first date
+        :param end: last date (exclusive), None for all dates after start
+        :return: Series with the close price for every trading day, empty if there is no data for the ticker
+        """
+        if ticker not in self.prices:
+            return pd.Series(dtype=float)
+        prices = self.prices[ticker].dropna()
+        prices = prices[prices.index >= pd.Timestamp(start)]
+        if end is not None:
+            prices = prices[prices.index < pd.Timestamp(end)]
+        return prices
+
+
+def fetch_prices(provider, ticker, start, end=None, retries=3, backoff=1.0):
+    """
+    Gets the close prices of one stock. Failed requests are repeated with a growing waiting time.
+    :param provider: price provider, p.e. YahooPriceProvider()
+    :param ticker: stock ticker
+    :param start: first date
+    :param end: last date (exclusive), None for today
+    :param retries: number of repetitions of a failed request
+    :param backoff: waiting time in seconds before the first repetition, doubles with every further repetition
+    :return: Series with the close prices, None if all requests failed
+    """
+    for attempt in range(retries + 1):
+        try:
+            return provider.history(ticker, start, end)
+        # the providers raise all kinds of network and parsing errors
+        except Exception as error:
+            if attempt == retries:
+                print(f'{ticker}: {error}')
+                return None
+            time.sleep(backoff * 2 ** attempt)
+
+
+def period_returns(prices, freq='M'):
+    """
+    Compounds the daily returns of every stock to monthly or weekly returns. The product of every period is calculated
+    for all stocks at once, a period without any return has a return of 0.
+    :param prices: DataFrame with the daily close prices, one column per ticker
+    :param freq: 'M' for monthly, 'W' for weekly returns
+    :return: DataFrame with the return of every period (index: last day of the period)
+    """
+    return (prices.pct_change() + 1).resample(freq).prod() - 1
+
+
+def cap_weighted_index(prices, shares):
+    """
+    Creates a market index out of the stock prices. The return of every day is the average return of the stocks
+    weighted by their market capitalization (price x shares) of the day before, all days are calculated at once.
+    :param prices: DataFrame with the daily close prices, one column per ticker
+    :param shares: Series with the number of shares of every ticker, stocks without shares are left out
+    :return: Series with the value of the index (1 on the first day)
+    """
+    values = prices.to_numpy(dtype=float)
+    caps = values[:-1] * shares.reindex(prices.columns).to_numpy(dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns = values[1:] / values[:-1] - 1
+        # only stocks with a market capitalization and a return on that day
+        valid = ~np.isnan(returns) & ~np.isnan(caps)
+        weights = np.where(valid, caps, 0)
+        index_returns = (np.where(valid, returns, 0) * weights).sum(axis=1) / weights.sum(axis=1)
+    return pd.Series(np.concatenate([[1.0], np.cumprod(1 + np.nan_to_num(index_returns))]), index=prices.index)
+
+
+# folder of the price store
+price_store_dir = './data/prices'
+
+# ticker of the market index, its prices are kept in the price store next to the prices of the stocks
+market_index_ticker = '^W5000'
+
+
+class PriceStore:
+    """
+    Persistent store of the daily close prices of every ticker. For every ticker it records the covered date range, so
+    later updates only request the missing days before and after that range. Tickers without any data or without new
+    prices for a while (delisted) are only requested again after some days.
+    Files in the store folder:
+    - prices.parquet: one row per ticker and date with the close price
+    - coverage.parquet: one row per ticker with the covered range (start inclusive, end exclusive), the date of the last
+      price, the status (ok, no_data or delisted) and the date of the last check
+    """
+
+    def __init__(self, path=price_store_dir, provider=None, delisted_after=30, recheck_after=30):
+        """
+        :param path: folder of the store
+        :param provider: price provider, None for Yahoo Finance
+        :param delisted_after: number of days without new prices after which a ticker counts as delisted
+        :param recheck_after: number of days after which tickers without data or delisted tickers are requested again
+        """
+        self.path = path
+        self.provider = provider if provider is not None else YahooPriceProvider()
+        self.delisted_after = pd.Timedelta(days=delisted_after)
+        self.recheck_after = pd.Timedelta(days=recheck_after)
+
+        if os.path.exists(f'{path}/prices.parquet'):
+            self.data = pd.read_parquet(f'{path}/prices.parquet')
+            self.coverage = pd.read_parquet(f'{path}/coverage.parquet')
+        else:
+            self.data = pd.DataFrame({'ticker': pd.Series(dtype=str), 'Date': pd.Series(dtype='datetime64[ns]'),
+                                      'close': pd.Series(dtype=float)})
+            self.coverage = pd.DataFrame({column: pd.Series(dtype='datetime64[ns]')
+                                          for column in ['start', 'end', 'last_price', 'checked']})
+            self.coverage['status'] = pd.Series(dtype=str)
+            self.coverage.index.name = 'ticker'
+
+    def missing_ranges(self, ticker, start, end):
+        """
+        :param ticker: stock ticker
+        :param start: first date
+        :param end: last date (exclusive)
+        :return: list of date ranges (start, end exclusive) that are not in the store yet
+        """
+        if ticker not in self.coverage.index:
+            return [(start, end)]
+
+        covered = self.coverage.loc[ticker]
+        # do not ask for new prices of tickers without data or delisted tickers on every run, earlier prices still
+        # have to be requested
+        recent = pd.Timestamp.today().normalize() - covered['checked'] < self.recheck_after
+        ranges = []
+        if start < covered['start']:
+            ranges.append((start, covered['start']))
+        if end > covered['end'] and (covered['status'] == 'ok' or not recent):
+            ranges.append((covered['end'], end))
+        return ranges
+
+    def update(self, tickers, start, end=None, workers=8, retries=3, backoff=1.0):
+        """
+        Requests the missing prices of the tickers and saves them in the store.
+        :param tickers: list of stock tickers
+        :param start: first date
+        :param end: last date (exclusive), None for today (the close price of today is not final yet)
+        :param workers: number of concurrent requests
+        :param retries: number of repetitions of a failed request
+        :param backoff: waiting time in seconds before the first repetition, doubles with every further repetition
+        :return: number of requests
+        """
+        today = pd.Timestamp.today().normalize()
+        start = pd.Timestamp(start).normalize()
+        end = pd.Timestamp(end).normalize() if end is not None else today
+        tickers = list(dict.fromkeys(tickers))
+
+        # find missing ranges
+        requests = [(ticker, range_start, range_end) for ticker in tickers
+                    for range_start, range_end in self.missing_ranges(ticker, start, end)]
+        if not requests:
+            return 0
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                lambda request: fetch_prices(self.provider, request[0], request[1].strftime('%Y-%m-%d'),
+                                             request[2].strftime('%Y-%m-%d'), retries, backoff), requests))
+
+        # add new prices, failed requests are not added to the coverage and requested again next time
+        new_data = []
+        answered = {}
+        for (ticker, range_start, range_end), prices in zip(requests, results):
+            if prices is None:
+                continue
+            answered.setdefault(ticker, []).append((range_start, range_end))
+            prices = prices.dropna()
+            if len(prices) > 0:
+                dates = pd.DatetimeIndex(prices.index)
+                if dates.tz is not None:
+                    dates = dates.tz_localize(None)
+                new_data.append(pd.DataFrame({'ticker': ticker, 'Date': dates.normalize(), 'close': prices.to_numpy()}))
+
+        if new_data:
+            self.data = pd.concat([self.data] + new_data, ignore_index=True)
+            self.data = self.data.drop_duplicates(subset=['ticker', 'Date'], keep='last')
+            self.data = self.data.sort_values(['ticker', 'Date'], ignore_index=True)
+
+        # update coverage
+        last_price = self.data.groupby('ticker')['Date'].max()
+        for ticker, ranges in answered.items():
+            range_start = min(range_start for range_start, range_end in ranges)
+            range_end = max(range_end for range_start, range_end in ranges)
+            if ticker in self.coverage.index:
+                range_start = min(range_start, self.coverage.at[ticker, 'start'])
+                range_end = max(range_end, self.coverage.at[ticker, 'end'])
+
+            if ticker not in last_price.index:
+                status = 'no_data'
+            elif range_end - last_price[ticker] > self.delisted_after:
+                status = 'delisted'
+            else:
+                status = 'ok'
+            self.coverage.loc[ticker, ['start', 'end', 'last_price', 'checked', 'status']] = \
+                [range_start, range_end, last_price.get(ticker, pd.NaT), today, status]
+
+        self.save()
+        return len(requests)
+
+    def save(self):
+        """
+        Saves prices and coverage in the store folder.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        self.data.to_parquet(f'{self.path}/prices.parquet')
+        self.coverage.to_parquet(f'{self.path}/coverage.parquet')
+
+    def prices(self, tickers=None, start=None, end=None):
+        """
+        Creates the close price matrix out of the store.
+        :param tickers: list of stock tickers, None for all tickers in the store
+        :param start: first date, None for all dates
+        :param end: last date (exclusive), None for all dates
+        :return: DataFrame with the close prices, one column per ticker (all NA if there is no data for a ticker)
+        """
+        data = self.data
+        if tickers is not None:
+            tickers = list(dict.fromkeys(tickers))
+            data = data[data['ticker'].isin(tickers)]
+        if start is not None:
+            data = data[data['Date'] >= pd.Timestamp(start)]
+        if end is not None:
+            data = data[data['Date'] < pd.Timestamp(end)]
+
+        df_prices = data.pivot(index='Date', columns='ticker', values='close')
+        if tickers is not None:
+            df_prices = df_prices.reindex(columns=tickers)
+        df_prices.columns.name = None
+        return df_prices
@@ -0,0 +1,270 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from functools import partial
+from itertools import repeat
+import pandas as pd
+import strategies
+from backtest import run_backtests
+from instrumentation import collect, recorder
+from stats import ExpandingBetas
+
+# start date of the market index for the betting against beta strategy
+beta_start_date = '2015-01-01'
+
+
+def create_tasks(beta_start=beta_start_date, as_of=None, state=None):
+    """
+    Creates the dependency graph of the strategies and the intermediate data they share. Every task is a function and
+    a dict with the keyword arguments of the function and the tasks that create them.
+    :param beta_start: start date of the market index for the betting against beta strategy
+    :param as_of: date of the signals, only data known at that date is used (None: all data)
+    :param state: sums of earlier dates for a sequence of dates (see walk_state), None to calculate everything out of
+                  all data
+    :return: dict with name of the task and tuple of function and dependencies
+    """
+    state = state if state is not None else {}
+    return {
+        # intermediate data
+        'book_to_market': (partial(strategies.book_to_market, as_of=as_of), {}),
+        'daily_returns': (partial(strategies.daily_returns, as_of=as_of), {}),
+        'monthly_returns': (partial(strategies.monthly_returns, as_of=as_of), {}),
+        # strategies
+        'f_score': (partial(strategies.f_score, as_of=as_of), {'btm': 'book_to_market'}),
+        'pead': (partial(strategies.pead, as_of=as_of), {}),
+        'momentum': (partial(strategies.momentum, as_of=as_of), {'monthly': 'monthly_returns'}),
+        'g_score': (partial(strategies.g_score, as_of=as_of), {'btm': 'book_to_market'}),
+        'accrual_anatomy': (partial(strategies.accrual_anatomy, as_of=as_of), {}),
+        'betting_against_beta': (partial(strategies.betting_against_beta, beta_start, as_of=as_of,
+                                         expanding=state.get('betas')), {'daily': 'daily_returns'}),
+        'equity_pairs': (partial(strategies.equity_pairs, as_of=as_of), {'monthly': 'monthly_returns'}),
+    }
+
+
+def walk_state():
+    """
+    :return: dict with the sums that are kept from date to date of a walk forward (betas: every date only adds its new
+             days)
+    """
+    return {'betas': ExpandingBetas()}
+
+
+# names of the strategies in the order of the app
+strategy_names = ['f_score', 'pead', 'momentum', 'g_score', 'accrual_anatomy', 'betting_against_beta', 'equity_pairs']
+
+
+def required_tasks(tasks, names):
+    """
+    :param tasks: dependency graph (see create_tasks)
+    :param names: names of the requested tasks
+    :return: set with the requested tasks and all tasks they depend on
+    """
+    required = set()
+    stack = list(names)
+    while stack:
+        name = stack.pop()
+        if name not in required:
+            required.add(name)
+            stack.extend(tasks[name][1].values())
+    return required
+
+
+def run_task(function, kwargs):
+    """
+    :param function: function of the task
+    :param kwargs: keyword arguments with the results of the dependencies
+    :return: result of the task
+    """
+    return function(**kwargs)
+
+
+def run(names=None, workers=1, beta_start=beta_start_date, as_of=None, state=None, errors=None):
+    """
+    Runs the strategies. Every intermediate data is only created once, as soon as all dependencies of a task are done it
+    is started. With more than one worker, independent tasks run at the same time in separate processes.
+    :param names: list of the strategies, None for all strategies
+    :param workers: number of processes, 1 to run everything in this process
+    :param beta_start: start date of the market index for the betting against beta strategy
+    :param as_of: date of the signals, only data known at that date is used (None: all data, the signals are saved for
+                  the app)
+    :param state: sums of earlier dates (see walk_state), None to calculate everything out of all data (only kept with
+                  one worker)
+    :param errors: dict that collects the errors of failed strategies (name and error message), the strategies get empty
+                   signals and the other strategies still run, None to raise the first error
+    :return: dict with name and signals of every strategy
+    """
+    names = names if names is not None else strategy_names
+    tasks = create_tasks(beta_start, as_of, state)
+    pending = required_tasks(tasks, names)
+    results = {}
+    failed = {}
+
+    def ready():
+        return [name for name in sorted(pending) if all(dependency in results or dependency in failed
+                                                        for dependency in tasks[name][1].values())]
+
+    def arguments(name):
+        return {argument: results[dependency] for argument, dependency in tasks[name][1].items()}
+
+    def skip(name):
+        # a task without its intermediate data fails with the error of the intermediate data
+        for dependency in tasks[name][1].values():
+            if dependency in failed:
+                failed[name] = failed[dependency]
+                return True
+        return False
+
+    def fail(name, error):
+        if errors is None:
+            raise error
+        failed[name] = f'{type(error).__name__}: {error}'
+
+    if workers == 1:
+        while pending:
+            for name in ready():
+                pending.remove(name)
+                if skip(name):
+                    continue
+                try:
+                    results[name] = run_task(tasks[name][0], arguments(name))
+                except Exception as error:
+                    fail(name, error)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            running = {}
+            while pending or running:
+                for name in ready():
+                    pending.remove(name)
+                    if not skip(name):
+                        running[executor.submit(collect, run_task, tasks[name][0], arguments(name))] = name
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        # the stages of the workers are handed back with the results
+                        results[name], records = future.result()
+                        recorder.records.extend(records)
+                    except Exception as error:
+                        fail(name, error)
+
+    if errors is not None:
+        errors.update({name: failed[name] for name in names if name in failed})
+    return {name: results[name] if name in results else pd.Series(dtype=object, name='Signal') for name in names}
+
+
+def signal_panel(signals):
+    """
+    :param signals: dict with date and signals of a strategy on that date (Series or DataFrame with a 'Signal' column)
+    :return: DataFrame (dates x stocks) with 'Long'/'Short', NaN for no position
+    """
+    rows = {}
+    for date, signal in signals.items():
+        if isinstance(signal, pd.DataFrame):
+            signal = signal['Signal']
+        # some companies share a ticker --> first signal
+        rows[pd.Timestamp(date)] = signal[~signal.index.duplicated()]
+    return pd.DataFrame.from_dict(rows, orient='index').sort_index()
+
+
+def walk_dates(dates, names, beta_start=beta_start_date):
+    """
+    Runs the strategies for consecutive dates in this process, the betas keep their sums from date to date (see
+    walk_state). A failed strategy gets empty signals on that date and the walk goes on.
+    :param dates: sorted list of the dates
+    :param names: list of the strategies
+    :param beta_start: start date of the market index for the betting against beta strategy
+    :return: tuple of the list with the signals of every date (see run) and the list of errors (date, strategy and
+             error message)
+    """
+    state = walk_state()
+    results = []
+    errors = []
+    for date in dates:
+        failed = {}
+        results.append(run(names, 1, beta_start, date, state, failed))
+        errors.extend((date, name, error) for name, error in failed.items())
+    return results, errors
+
+
+def walk_forward(dates, names=None, workers=1, beta_start=beta_start_date, errors=None):
+    """
+    Creates the signals of the strategies for a sequence of dates (p.e. every month end) as they were known on every
+    date: only statements filed and prices known until the date are used. The data is read once per process and kept
+    in memory, every date only cuts it at the date (prices, daily and monthly returns are calculated once). The betas
+    keep their sums from date to date and only add the new days. The other strategies are calculated again on every
+    date, so the cost of a walk grows with the number of dates. The dates are split into consecutive chunks, one per
+    process.
+    :param dates: list of the dates
+    :param names: list of the strategies, None for all strategies
+    :param workers: number of processes, 1 to run everything in this process
+    :param beta_start: start date of the market index for the betting against beta strategy
+    :param errors: list that collects the failed strategies (date, strategy and error message), None to print them
+    :return: dict with name of every strategy and DataFrame (dates x stocks) with the signals of every date (no
+             signals on the dates where the strategy failed)
+    """
+    names = names if names is not None else strategy_names
+    dates = sorted(pd.Timestamp(date) for date in dates)
+
+    if workers == 1:
+        results, failed = walk_dates(dates, names, beta_start)
+    else:
+        chunk_size = max(-(-len(dates) // workers), 1)
+        chunks = [dates[start:start + chunk_size] for start in range(0, len(dates), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunk_results = list(executor.map(collect, repeat(walk_dates), chunks, repeat(names), repeat(beta_start)))
+        results, failed = [], []
+        for (chunk, chunk_errors), records in chunk_results:
+            results.extend(chunk)
+            failed.extend(chunk_errors)
+            recorder.records.extend(records)
+
+    if errors is not None:
+        errors.extend(failed)
+    else:
+        for date, name, error in failed:
+            print(f'{name} failed on {date:%Y-%m-%d}: {error}')
+    return {name: signal_panel({date: result[name] for date, result in zip(dates, results)}) for name in names}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Creates the signals of the trading strategies.')
+    parser.add_argument('strategies', nargs='*', metavar='strategy',
+                        help=f'strategies to run (default: all): {", ".join(strategy_names)}')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of processes')
+    parser.add_argument('--beta-start', default=beta_start_date,
+                        help='start date of the market index for betting against beta')
+    parser.add_argument('--as-of', help='date of the signals, only data known at that date is used (default: today)')
+    parser.add_argument('--walk-forward', metavar='START',
+                        help='create the signals of every month end from START until the as-of date')
+    parser.add_argument('--backtest', action='store_true', help='backtest the strategies for the app afterwards')
+    parser.add_argument('--stage-log', metavar='PATH', help='append the timings of all stages as JSON lines')
+    parser.add_argument('--metrics', metavar='PATH', help='write the timings of all stages as Prometheus text file')
+    args = parser.parse_args()
+    unknown = [strategy for strategy in args.strategies if strategy not in strategy_names]
+    if unknown:
+        parser.error(f'unknown strategies: {", ".join(unknown)}')
+
+    if args.walk_forward:
+        month_ends = pd.date_range(args.walk_forward, args.as_of or pd.Timestamp.today(), freq='M')
+        panels = walk_forward(month_ends, args.strategies or None, args.workers, args.beta_start)
+        for strategy, panel in panels.items():
+            print(f'{strategy}: signals for {len(panel)} dates')
+        if args.backtest:
+            for strategy, stats in run_backtests(panels).items():
+                print(f'{strategy} backtest: {stats}')
+    else:
+        failures = {}
+        for strategy, signals in run(args.strategies or None, args.workers, args.beta_start, args.as_of,
+                                     errors=failures).items():
+            print(f'{strategy}: {len(signals)} signals' if strategy not in failures else
+                  f'{strategy} failed: {failures[strategy]}')
+        if args.backtest:
+            for strategy, stats in run_backtests().items():
+                print(f'{strategy} backtest: {stats}')
+
+    if args.stage_log:
+        recorder.export_json_lines(args.stage_log)
+    if args.metrics:
+        recorder.export_prometheus(args.metrics)
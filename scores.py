@@ -0,0 +1,49 @@
+import numpy as np
+
+# comparisons of the criteria
+operators = ['>', '<', '<=', '>=']
+
+
+def criteria_matrix(values, thresholds, comparisons, missing=None):
+    """
+    Evaluates all criteria of a score for all rows (p.e. every company and year) at once. Every criterion compares a
+    column of the values with its threshold, the columns with the same comparison are evaluated together.
+    :param values: 2D float array (rows x criteria) with the measures
+    :param thresholds: thresholds, a number per criterion (list) or a 2D array (rows x criteria, p.e. industry
+                       medians)
+    :param comparisons: list with the comparison of every criterion: '>', '<', '<=' or '>=' (value compared to threshold)
+    :param missing: list with the result of every criterion for a missing value (default: False)
+    :return: boolean matrix (rows x criteria), True if the criterion is met
+    """
+    values = np.ascontiguousarray(values, dtype=float)
+    thresholds = np.broadcast_to(np.asarray(thresholds, dtype=float), values.shape)
+    comparisons = np.asarray(comparisons)
+    unknown = set(comparisons) - set(operators)
+    if unknown:
+        raise ValueError(f'unknown comparisons {sorted(unknown)}, use {operators}')
+
+    # every comparison only on its own columns
+    met = np.zeros(values.shape, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        for comparison, compare in zip(operators, [np.greater, np.less, np.less_equal, np.greater_equal]):
+            columns = np.flatnonzero(comparisons == comparison)
+            if len(columns):
+                met[:, columns] = compare(values[:, columns], thresholds[:, columns])
+
+    if missing is not None:
+        met = np.where(np.isnan(values), np.asarray(missing, dtype=bool), met)
+    return met
+
+
+def score(values, thresholds, comparisons, missing=None):
+    """
+    :param values: 2D float array (rows x criteria) with the measures
+    :param thresholds: thresholds of the criteria (see criteria_matrix)
+    :param comparisons: comparisons of the criteria (see criteria_matrix)
+    :param missing: result of every criterion for a missing value (see criteria_matrix)
+    :return: tuple of two arrays: number of met criteria and number of missing measures of every row
+    """
+    values = np.ascontiguousarray(values, dtype=float)
+    met = criteria_matrix(values, thresholds, comparisons, missing)
+    return met.sum(axis=1), np.isnan(values).sum(axis=1)
+
@@ -0,0 +1,321 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+
+def trading_days(index):
+    """
+    :param index: DatetimeIndex, with or without time zone
+    :return: DatetimeIndex with the dates only (no time zone, no time)
+    """
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return index.normalize()
+
+
+def window_sums(values, window):
+    """
+    :param values: 2D array (dates x stocks)
+    :param window: number of rows of the window
+    :return: sum over the last window rows for every row, calculated with cumulative sums (NaN for the first rows)
+    """
+    sums = np.full(values.shape, np.nan)
+    if window > len(values):
+        return sums
+    cumulative = np.cumsum(values, axis=0)
+    sums[window - 1] = cumulative[window - 1]
+    sums[window:] = cumulative[window:] - cumulative[:-window]
+    return sums
+
+
+def betas(returns, market, window=None, min_periods=None):
+    """
+    Calculates the betas of all stocks against the market at once. Every beta only uses the days where both the stock
+    and the market have a return: covariance and market variance are calculated on the same days.
+    With a window, the betas of every day are calculated out of the returns of the last window days (rolling sums of
+    cumulative sums, no loop over the days), p.e. window=756 for 36 months of daily returns. The betas for a monthly
+    rebalancing are then the betas of the last day of every month: betas(...).resample('M').last()
+    :param returns: DataFrame with the returns of the stocks, one column per stock
+    :param market: Series with the returns of the market
+    :param window: number of days of the rolling window, None for one beta over all days
+    :param min_periods: minimum number of days with returns of stock and market (default: 2 without window, else
+                        half of the window)
+    :return: Series with the beta of every stock, DataFrame (days x stocks) with a window
+    """
+    if min_periods is None:
+        min_periods = 2 if window is None else max(window // 2, 2)
+
+    # align market with the days of the stocks
+    market = pd.Series(market.to_numpy(dtype=float), index=trading_days(market.index))
+    market = market[~market.index.duplicated(keep='last')]
+    x = market.reindex(trading_days(returns.index)).to_numpy()[:, None]
+    y = returns.to_numpy(dtype=float)
+
+    # only days with stock and market return, centered to keep the sums small
+    valid = ~np.isnan(x) & ~np.isnan(y)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x = np.where(valid, x - np.nanmean(x), 0)
+        y = np.where(valid, y - np.where(valid, y, 0).sum(axis=0) / valid.sum(axis=0), 0)
+
+    if window is None:
+        n = valid.sum(axis=0)
+        sums = [np.sum(values, axis=0) for values in [x, y, x * y, x * x]]
+    else:
+        n = window_sums(valid.astype(float), window)
+        sums = [window_sums(values, window) for values in [x, y, x * y, x * x]]
+    sum_x, sum_y, sum_xy, sum_xx = sums
+
+    # covariance / market variance, (n - 1) cancels out
+    with np.errstate(invalid='ignore', divide='ignore'):
+        beta = (sum_xy - sum_x * sum_y / n) / (sum_xx - sum_x * sum_x / n)
+    beta = np.where(n >= min_periods, beta, np.nan)
+
+    if window is None:
+        return pd.Series(beta, index=returns.columns)
+    return pd.DataFrame(beta, index=returns.index, columns=returns.columns)
+
+
+def kept_rows(index, last):
+    """
+    :param index: dates of the rows of a date (p.e. a month end of a walk forward)
+    :param last: last date in the sums of the earlier dates, None for no sums
+    :return: position of the first row that is not in the sums yet, 0 if the sums have to start again (first date,
+             earlier date or the rows of the sums are not there anymore)
+    """
+    if last is None or last not in index:
+        return 0
+    position = index.get_loc(last)
+    return position + 1 if position < len(index) - 1 else 0
+
+
+def beta_sums(x, y):
+    """
+    :param x: 2D array (days x 1) with the market returns
+    :param y: 2D array (days x stocks) with the stock returns
+    :return: 2D array (stocks x 5) with the number of days with stock and market return and the sums of market return,
+             stock return, their product and the squared market return on these days
+    """
+    valid = ~np.isnan(x) & ~np.isnan(y)
+    x = np.where(valid, x, 0)
+    y = np.where(valid, y, 0)
+    return np.stack([valid.sum(axis=0), x.sum(axis=0), y.sum(axis=0), (x * y).sum(axis=0), (x * x).sum(axis=0)],
+                    axis=1)
+
+
+class ExpandingBetas:
+    """
+    Same as betas without window for a sequence of increasing dates, p.e. the month ends of a walk forward. The sums of
+    the days of the earlier dates are kept and every date only adds its new days, so a walk costs about as much as the
+    betas of the last date. Stocks that are new at a date get the sums of all their days. The last day of a date is
+    not kept in the sums, it can still change until the next date.
+    """
+
+    def __init__(self, min_periods=2):
+        """
+        :param min_periods: minimum number of days with returns of stock and market
+        """
+        self.min_periods = min_periods
+        self.last = None
+        self.columns = pd.Index([])
+        self.sums = np.zeros((0, 5))
+
+    def betas(self, returns, market):
+        """
+        :param returns: DataFrame with the returns of the stocks until the date, one column per stock
+        :param market: Series with the returns of the market
+        :return: Series with the beta of every stock over all days until the date
+        """
+        if len(returns) == 0:
+            return pd.Series(np.nan, index=returns.columns)
+
+        # align market with the days of the stocks
+        market = pd.Series(market.to_numpy(dtype=float), index=trading_days(market.index))
+        market = market[~market.index.duplicated(keep='last')]
+        x = market.reindex(trading_days(returns.index)).to_numpy()[:, None]
+        y = returns.to_numpy(dtype=float)
+
+        # sums of the earlier dates, new stocks get the sums of the days of the earlier dates first
+        first = kept_rows(returns.index, self.last)
+        positions = self.columns.get_indexer(returns.columns) if first > 0 else np.full(len(returns.columns), -1)
+        new = positions < 0
+        sums = np.zeros((len(returns.columns), 5))
+        sums[~new] = self.sums[positions[~new]]
+        sums[new] = beta_sums(x[:first], y[:first, new])
+
+        # add the new days, the last day only for this date
+        sums += beta_sums(x[first:-1], y[first:-1])
+        self.columns, self.sums, self.last = returns.columns, sums, returns.index[-2] if len(returns) > 1 else None
+        n, sum_x, sum_y, sum_xy, sum_xx = (sums + beta_sums(x[-1:], y[-1:])).T
+
+        # covariance / market variance, (n - 1) cancels out
+        with np.errstate(invalid='ignore', divide='ignore'):
+            beta = (sum_xy - sum_x * sum_y / n) / (sum_xx - sum_x * sum_x / n)
+        return pd.Series(np.where(n >= self.min_periods, beta, np.nan), index=returns.columns)
+
+
+def trailing_means(values, windows, skips):
+    """
+    Average of the last values before the latest rows are skipped, for every row and for several windows and skips at
+    once. All averages are differences of one cumulative sum, so more windows barely cost more. Same as
+    DataFrame.shift(skip).rolling(window).mean(): NaN as soon as a value in the window is missing.
+    :param values: 2D array (dates x stocks)
+    :param windows: list with the number of rows of every average
+    :param skips: list with the number of latest rows that are left out of every average (same length as windows)
+    :return: 3D array (windows x dates x stocks) with the averages
+    """
+    rows = len(values)
+    valid = ~np.isnan(values)
+    # cumulative sums with a leading row of zeros --> sum of rows i to j is cumulative[j + 1] - cumulative[i]
+    cumulative = np.zeros((rows + 1,) + values.shape[1:])
+    cumulative[1:] = np.cumsum(np.where(valid, values, 0), axis=0)
+    missing = np.zeros((rows + 1,) + values.shape[1:], dtype=np.int64)
+    missing[1:] = np.cumsum(~valid, axis=0)
+
+    means = np.full((len(windows),) + values.shape, np.nan)
+    for position, (window, skip) in enumerate(zip(windows, skips)):
+        first = window + skip - 1
+        if first >= rows:
+            continue
+        sums = cumulative[window:rows - skip + 1] - cumulative[:rows - skip - window + 1]
+        complete = missing[window:rows - skip + 1] == missing[:rows - skip - window + 1]
+        means[position, first:] = np.where(complete, sums / window, np.nan)
+    return means
+
+
+def quantile_signals(values, quantile=0.1):
+    """
+    Ranks the stocks of every row: long above the upper quantile, short up to the lower quantile (same edges as
+    pd.qcut). Rows of several rankings can be stacked and are ranked at once.
+    :param values: array (... x dates x stocks), NaN for stocks without a value
+    :param quantile: share of the stocks in the long and in the short leg, p.e. 0.1 for deciles
+    :return: int8 array of the same shape with 1 for long, -1 for short and 0 for no position
+    """
+    signals = np.zeros(values.shape, dtype=np.int8)
+    complete = ~np.isnan(values).all(axis=-1)
+    if not complete.any():
+        return signals
+    lower, upper = np.nanquantile(values[complete], [quantile, 1 - quantile], axis=-1)[:, :, None]
+    signals[complete] = np.where(values[complete] > upper, 1, np.where(values[complete] <= lower, -1, 0))
+    return signals
+
+
+def correlation_block(x, y):
+    """
+    Pearson correlations between the columns of two return matrices. Without missing values both matrices are
+    standardized and multiplied once. With missing values every pair of columns only uses the rows where both have a
+    return (same as DataFrame.corr).
+    :param x: 2D array (dates x stocks of the block)
+    :param y: 2D array (dates x all stocks)
+    :return: 2D array (stocks of the block x all stocks) with the correlations, NaN without variance
+    """
+    x_valid = ~np.isnan(x)
+    y_valid = ~np.isnan(y)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if x_valid.all() and y_valid.all():
+            x = (x - x.mean(axis=0)) / x.std(axis=0)
+            y = (y - y.mean(axis=0)) / y.std(axis=0)
+            return x.T @ y / len(x)
+
+        # center every column to keep the sums small, then sums over the rows where both columns have a value
+        x = np.where(x_valid, x - np.where(x_valid, x, 0).sum(axis=0) / x_valid.sum(axis=0), 0)
+        y = np.where(y_valid, y - np.where(y_valid, y, 0).sum(axis=0) / y_valid.sum(axis=0), 0)
+        x_valid = x_valid.astype(float)
+        y_valid = y_valid.astype(float)
+        n = x_valid.T @ y_valid
+        sum_x = x.T @ y_valid
+        sum_y = x_valid.T @ y
+        cov = x.T @ y - sum_x * sum_y / n
+        var_x = (x * x).T @ y_valid - sum_x * sum_x / n
+        var_y = x_valid.T @ (y * y) - sum_y * sum_y / n
+        return cov / np.sqrt(var_x * var_y)
+
+
+def top_correlations(returns, k=50, block_size=256):
+    """
+    Finds for every stock the k other stocks with the highest correlation of their returns. The correlations are
+    calculated for a block of stocks against all stocks at a time and only the k best partners of every stock are kept,
+    so the memory grows with the number of stocks times k (plus one block) instead of the square of the stocks.
+    :param returns: DataFrame with the returns of the stocks, one column per stock
+    :param k: number of partners per stock
+    :param block_size: number of stocks per block
+    :return: tuple of two arrays (stocks x k): column positions of the partners (-1 if there is no further partner) and
+             their correlations (NaN if there is no further partner), both ordered by descending correlation
+    """
+    values = returns.to_numpy(dtype=float)
+    stocks = values.shape[1]
+    k = min(k, stocks - 1)
+    neighbors = np.full((stocks, k), -1)
+    correlations = np.full((stocks, k), np.nan)
+
+    for start in range(0, stocks, block_size):
+        end = min(start + block_size, stocks)
+        corr = correlation_block(values[:, start:end], values)
+
+        # no partner: the stock itself and pairs without correlation
+        corr[np.arange(end - start), np.arange(start, end)] = np.nan
+        corr = np.where(np.isnan(corr), -np.inf, corr)
+
+        # k best partners, then order them
+        best = np.argpartition(-corr, k - 1, axis=1)[:, :k] if k > 0 else np.empty((end - start, 0), dtype=int)
+        best_corr = np.take_along_axis(corr, best, axis=1)
+        order = np.argsort(-best_corr, axis=1, kind='stable')
+        best = np.take_along_axis(best, order, axis=1)
+        best_corr = np.take_along_axis(best_corr, order, axis=1)
+
+        found = best_corr > -np.inf
+        neighbors[start:end] = np.where(found, best, -1)
+        correlations[start:end] = np.where(found, best_corr, np.nan)
+
+    return neighbors, correlations
+
+
+def write_correlations(returns, path, tile_size=1024, workers=4):
+    """
+    Writes the full correlation matrix of the returns as 32 bit floats into a memory-mapped .npy file, so matrices
+    larger than the memory can be created and read. The matrix is calculated in tiles of tile_size x tile_size stocks,
+    the tiles are calculated at the same time by a pool of threads (the matrix products run outside the GIL). Only the
+    tiles on and above the diagonal are calculated, the tiles below are their transposes.
+    The stocks of the rows and columns are saved next to the matrix ({path}.stocks.json).
+    :param returns: DataFrame with the returns of the stocks, one column per stock
+    :param path: path of the .npy file
+    :param tile_size: number of stocks per tile
+    :param workers: number of threads
+    :return: read-only memory-mapped correlation matrix
+    """
+    values = returns.to_numpy(dtype=float)
+    stocks = values.shape[1]
+    # create the file with its header, the tiles are written through memory maps of their own
+    matrix = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(stocks, stocks))
+    matrix.flush()
+    del matrix
+
+    def write_tile(tile):
+        row, column = tile
+        corr = correlation_block(values[:, row:row + tile_size], values[:, column:column + tile_size])
+        matrix = np.load(path, mmap_mode='r+')
+        matrix[row:row + tile_size, column:column + tile_size] = corr
+        matrix[column:column + tile_size, row:row + tile_size] = corr.T
+        matrix.flush()
+
+    tiles = [(row, column) for row in range(0, stocks, tile_size) for column in range(row, stocks, tile_size)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(write_tile, tiles))
+
+    with open(f'{path}.stocks.json', 'w') as file:
+        json.dump([str(stock) for stock in returns.columns], file)
+    return read_correlations(path)[0]
+
+
+def read_correlations(path):
+    """
+    Opens a correlation matrix written by write_correlations without reading it, rows are read from disk when they are
+    used (p.e. matrix[i] or matrix[:, j]).
+    :param path: path of the .npy file
+    :return: tuple of the read-only memory-mapped correlation matrix and the list of stocks of the rows and columns
+    """
+    with open(f'{path}.stocks.json') as file:
+        stocks = json.load(file)
+    return np.load(path, mmap_mode='r'), stocks
@@ -1,18 +1,49 @@
 import pandas as pd
 import numpy as np
-import yfinance as yf
-
-
-def book_to_market():
+import os
+from data_store import data_context
+from features import CompanyPanel
+from industries import industry_medians, industry_min_size
+from instrumentation import recorder
+from prices import cap_weighted_index, market_index_ticker
+from scores import score
+from stats import betas, quantile_signals, top_correlations, write_correlations
+
+# market index of the betting against beta strategy:
+# - ticker of an index in the price store (p.e. '^W5000', saved by create_data.get_stock_returns)
+# - 'cap_weighted' for an index out of the stock prices weighted by market capitalization
+# - Series with the close prices of any index
+market_index_source = market_index_ticker
+
+# criteria of the F-Score: measure, comparison with 0 and score of a missing measure
+f_score_criteria = [('RoA', '>', False), ('CFO', '>', False), ('delta_RoA', '>', False), ('accrual', '<', False),
+                    ('delta_leverage', '<', False), ('delta_liquid', '>', False), ('delta_equity', '<=', True),
+                    ('delta_gross_margin', '>', False), ('delta_turnover', '>', False)]
+
+# criteria of the G-Score: measure, comparison and True for a comparison with the industry median (False: with 0)
+g_score_criteria = [('RoA', '>', True), ('CFO', '>', True), ('accrual', '<', False), ('RoA_var', '<', True),
+                    ('Sales_growth_var', '<', True), ('RaD_intensity', '>', True), ('capex', '>', True),
+                    ('ads', '>', True)]
+
+# industries of the G-Score: number of digits of the SIC codes and True to fall back to the coarser levels for
+# industries with less than industry_min_size companies
+g_score_sic_digits = 2
+g_score_fallback = False
+
+
+@recorder.timed
+def book_to_market(as_of=None):
     """
     Calculates the book to market ratio (shareholders equity/ market cap) for every company based on the latest
     stock price and annual financial statement.
+    :param as_of: date of the ratio, only prices and statements known at that date are used (None: all data)
     :return: DataFrame with ratio for each company.
     """
 
     # load data
-    df_prices = pd.read_parquet('./data/stock_returns.parquet.gzip')
-    df_financials = pd.read_parquet("./data/financial_statements_annual.parquet.gzip")
+    df_prices = data_context.stock_prices(as_of)
+    df_financials = data_context.financials(columns=['year', 'cik', 'ticker', 'StockholdersEquity',
+                                                     'WeightedAverageNumberOfSharesOutstandingBasic'], as_of=as_of)
 
     # price data
     # only keep latest date
@@ -29,7 +60,7 @@ def book_to_market():
                                    'WeightedAverageNumberOfSharesOutstandingBasic']]
 
     # only keep companies with at least 2 annual statements
-    df_financials = df_financials.groupby('cik').filter(lambda x: len(x) > 2)
+    df_financials = df_financials[df_financials.groupby('cik')['cik'].transform('size') > 2]
 
     # for every company keep the latest values
     df_financials = df_financials.sort_values('year', ascending=False).drop_duplicates('cik').sort_index()
@@ -54,7 +85,46 @@ def book_to_market():
     return df_financials
 
 
-def f_score():
+def traded_stocks(as_of=None):
+    """
+    :param as_of: date, only prices until that date are used (None: all prices)
+    :return: stocks that are still traded
+    """
+
+    # load data
+    df = data_context.stock_prices(as_of)
+
+    # drop columns with all #NA and last rows #NA --> not tradeable anymore
+    df = df.dropna(axis=1, how='all')
+    df = df.dropna(axis=1, subset=[df.index[-5]], how='all')
+    return df.columns
+
+
+@recorder.timed
+def daily_returns(as_of=None):
+    """
+    Calculates the daily returns of all stocks that are still traded.
+    :param as_of: date, only prices until that date are used (None: all prices)
+    :return: DataFrame with the daily return for every stock
+    """
+    df = data_context.daily_returns(as_of)
+    return df[traded_stocks(as_of)]
+
+
+@recorder.timed
+def monthly_returns(freq='M', as_of=None):
+    """
+    Monthly (or weekly) returns of all stocks that are still traded, out of the shared return matrix of all stocks.
+    :param freq: 'M' for monthly, 'W' for weekly returns
+    :param as_of: date, only prices until that date are used (None: all prices)
+    :return: DataFrame with the monthly return for every stock
+    """
+    df = data_context.period_returns(freq, as_of)
+    return df[traded_stocks(as_of)]
+
+
+@recorder.timed
+def f_score(btm=None, as_of=None):
     """
     Creates the data for the F-Score strategy.
     Steps:
@@ -65,109 +135,138 @@ def f_score():
     5) Keep latest annual statement for each company
     6) Only keep companies that have at least 5 measures
     7) Create signal
+    :param btm: book to market ratios (see book_to_market), None to calculate them
+    :param as_of: date of the signals, only data known at that date is used (None: all data, the signals are saved for
+                  the app)
     :return: DataFrame indicating which stocks to long and short
     """
 
     # load data
-    df_financials = pd.read_parquet("./data/financial_statements_annual.parquet.gzip")
+    df_financials = data_context.financials(columns=f_score_columns, as_of=as_of)
 
     # create book to market ratio
-    btm = book_to_market()
+    if btm is None:
+        btm = book_to_market(as_of)
 
-    # keep top 5 quantile
-    btm['quantile_rank'] = pd.qcut(btm['book_to_market'], 5, labels=False)
+    # keep top 5 quantile (ranked on a copy, the book to market data is shared with other strategies)
+    btm = btm.assign(quantile_rank=pd.qcut(btm['book_to_market'], 5, labels=False))
     btm = btm[btm.loc[:, 'quantile_rank'] == 4]
 
     # keep companies in top 5 quantile in financial DataFrame
     df_financials = df_financials.merge(btm, how='inner', left_on='ticker', right_index=True)
 
+    # scores of all years at once
+    df_financials = f_score_measures(df_financials)
+    df_financials = df_financials.join(f_scores(df_financials))
+
+    # for every company keep the latest values
+    df_financials = df_financials.sort_values('year', ascending=False).drop_duplicates('cik').sort_index()
+
+    # remove companies with too many missing values
+    df_financials = df_financials[df_financials.loc[:, 'missing_values'] < 5]
+
+    # create signal
+    df_financials['Signal'] = np.where(df_financials['score'] >= 7, 'Long',
+                                       np.where(df_financials['score'] <= 2, 'Short', np.nan))
+    df_financials = df_financials[df_financials.loc[:, 'Signal'].isin(['Long', 'Short'])]
+    df_financials.index = df_financials['ticker']
+    df_financials.index.name = 'Stock'
+    df_financials = df_financials['Signal']
+
+    # only the signals of today are shown in the app
+    if as_of is None:
+        df_financials.to_excel('./data/f_score.xlsx')
+    return df_financials
+
+
+# columns of the annual data for the F-Score
+f_score_columns = ['year', 'cik', 'ticker', 'Assets', 'AssetsCurrent', 'Liabilities', 'LiabilitiesCurrent',
+                   'OtherLiabilitiesNoncurrent', 'OperatingIncomeLoss', 'NetCashProvidedByUsedInOperatingActivities',
+                   'WeightedAverageNumberOfSharesOutstandingBasic', 'Revenues',
+                   'RevenueFromContractWithCustomerExcludingAssessedTax', 'CostOfGoodsAndServicesSold',
+                   'CostOfRevenue']
+
+
+def f_score_measures(df_financials):
+    """
+    Calculates the measures of the 9 F-Score criteria for every company and year.
+    :param df_financials: annual data with the columns of f_score_columns
+    :return: DataFrame with the measures as additional columns
+    """
+    # sort companies by year once for all lags and deltas
+    panel = CompanyPanel(df_financials)
+
     # Get assets beginning of the year and avg last 2 years
-    df_financials['assets_beginning'] = df_financials.groupby('cik', sort=False)['Assets'].apply(
-        lambda x: (x.shift())).to_numpy()
-    df_financials['assets_avg'] = df_financials.groupby('cik', sort=False)['Assets'].apply(
-        lambda x: ((x+x.shift())/2)).to_numpy()
+    df_financials['assets_beginning'] = panel.lag(df_financials['Assets'])
+    df_financials['assets_avg'] = panel.average(df_financials['Assets'])
     # first year for every company --> keep assets of that year
     df_financials['assets_avg'] = df_financials['assets_avg'].fillna(df_financials['Assets'])
 
     # score 1 - RoA
     df_financials['RoA'] = df_financials['OperatingIncomeLoss']/df_financials['assets_beginning']
-    df_financials['score_1'] = np.where(df_financials['RoA'] > 0, 1, 0)
 
     # score 2 - CFO
     df_financials['CFO'] = df_financials['NetCashProvidedByUsedInOperatingActivities']/df_financials['assets_beginning']
-    df_financials['score_2'] = np.where(df_financials['CFO'] > 0, 1, 0)
 
     # score 3 - delta RoA
-    df_financials['delta_RoA'] = df_financials.groupby('cik', sort=False)['RoA'].apply(
-        lambda x: (x.shift())).to_numpy()
-    df_financials['score_3'] = np.where(df_financials['delta_RoA'] > 0, 1, 0)
+    df_financials['delta_RoA'] = panel.lag(df_financials['RoA'])
 
     # score 4 - Accruals
     df_financials['accrual'] = df_financials['RoA']-df_financials['CFO']
-    df_financials['score_4'] = np.where(df_financials['accrual'] < 0, 1, 0)
 
     # score 5 - delta Leverage
     df_financials['noncurrent_liab'] = df_financials['Liabilities']-df_financials['LiabilitiesCurrent']
     df_financials['noncurrent_liab'] = df_financials['noncurrent_liab'].fillna(df_financials['OtherLiabilitiesNoncurrent'])
     df_financials['leverage'] = df_financials['noncurrent_liab']/df_financials['assets_avg']
-    df_financials['delta_leverage'] = df_financials.groupby('cik', sort=False)['leverage'].apply(
-        lambda x: (x-x.shift())).to_numpy()
-    df_financials['score_5'] = np.where(df_financials['delta_leverage'] < 0, 1, 0)
+    df_financials['delta_leverage'] = panel.delta(df_financials['leverage'])
 
     # score 6 - delta liquid
     df_financials['current_ratio'] = df_financials['AssetsCurrent']/df_financials['LiabilitiesCurrent']
-    df_financials['delta_liquid'] = df_financials.groupby('cik', sort=False)['current_ratio'].apply(
-        lambda x: (x-x.shift())).to_numpy()
-    df_financials['score_6'] = np.where(df_financials['delta_liquid'] > 0, 1, 0)
+    df_financials['delta_liquid'] = panel.delta(df_financials['current_ratio'])
 
     # score 7 - Equity-offer
-    df_financials['delta_equity'] = df_financials.groupby('cik', sort=False)['WeightedAverageNumberOfSharesOutstandingBasic'].apply(
-        lambda x: (x - x.shift())).to_numpy()
-    df_financials['score_7'] = np.where(df_financials['delta_equity'] > 0, 0, 1)
+    df_financials['delta_equity'] = panel.delta(df_financials['WeightedAverageNumberOfSharesOutstandingBasic'])
 
     # score 8 - delta margin
     df_financials['Revenues'] = df_financials['Revenues'].fillna(df_financials['RevenueFromContractWithCustomerExcludingAssessedTax'])
     df_financials['gross_profit'] = df_financials['Revenues']-df_financials['CostOfGoodsAndServicesSold']
     df_financials['gross_profit'] = df_financials['gross_profit'].fillna(df_financials['Revenues']-df_financials['CostOfRevenue'])
     df_financials['gross_margin'] = df_financials['gross_profit']/df_financials['Revenues']
-    df_financials['delta_gross_margin'] = df_financials.groupby('cik', sort=False)['gross_margin'].apply(
-        lambda x: (x-x.shift())).to_numpy()
-    df_financials['score_8'] = np.where(df_financials['delta_gross_margin'] > 0, 1, 0)
+    df_financials['delta_gross_margin'] = panel.delta(df_financials['gross_margin'])
 
     # score 9 - delta turn
     df_financials['turnover_ratio'] = df_financials['Revenues'] / df_financials[
         'assets_beginning']
-    df_financials['delta_turnover'] = df_financials.groupby('cik', sort=False)['turnover_ratio'].apply(
-        lambda x: (x - x.shift())).to_numpy()
-    df_financials['score_9'] = np.where(df_financials['delta_turnover'] > 0, 1, 0)
-
-    # for every company keep the latest values
-    df_financials = df_financials.sort_values('year', ascending=False).drop_duplicates('cik').sort_index()
+    df_financials['delta_turnover'] = panel.delta(df_financials['turnover_ratio'])
+    return df_financials
 
-    # count number of missing values and remove big numbers
-    df_financials['missing_values'] = df_financials[['RoA', 'CFO', 'delta_RoA', 'accrual', 'delta_leverage',
-                                                     'delta_liquid', 'delta_gross_margin', 'delta_turnover',
-                                                     'delta_equity']].isnull().sum(axis=1)
-    df_financials = df_financials[df_financials.loc[:, 'missing_values'] < 5]
 
-    # final score
-    df_financials['score'] = df_financials['score_1']+df_financials['score_2']+df_financials['score_3']+\
-                             df_financials['score_4']+df_financials['score_5']+df_financials['score_6']+\
-                             df_financials['score_7']+df_financials['score_8']+df_financials['score_9']
+def f_scores(df_financials):
+    """
+    Evaluates the 9 criteria of every company and year as one boolean matrix.
+    :param df_financials: annual data with the measures (see f_score_measures)
+    :return: DataFrame with the F-Score and the number of missing measures of every company and year
+    """
+    measures = df_financials[[measure for measure, _, _ in f_score_criteria]].to_numpy(dtype=float)
+    scores, missing = score(measures, 0, [comparison for _, comparison, _ in f_score_criteria],
+                            [missing for _, _, missing in f_score_criteria])
+    return pd.DataFrame({'score': scores, 'missing_values': missing}, index=df_financials.index)
 
-    # create signal
-    df_financials['Signal'] = np.where(df_financials['score'] >= 7, 'Long',
-                                       np.where(df_financials['score'] <= 2, 'Short', np.nan))
-    df_financials = df_financials[df_financials.loc[:, 'Signal'].isin(['Long', 'Short'])]
-    df_financials.index = df_financials['ticker']
-    df_financials.index.name = 'Stock'
-    df_financials = df_financials['Signal']
 
-    df_financials.to_excel('./data/f_score.xlsx')
-    return df_financials
+@recorder.timed
+def f_score_history(as_of=None):
+    """
+    F-Score of every company and year, p.e. for a backtest (without the book to market filter of the strategy).
+    :param as_of: only statements filed until this date, None for all statements
+    :return: DataFrame with year, cik, ticker, F-Score and number of missing measures of every annual statement
+    """
+    df = f_score_measures(data_context.financials(columns=f_score_columns, as_of=as_of))
+    df = df.join(f_scores(df))
+    return df[['year', 'cik', 'ticker', 'score', 'missing_values']]
 
 
-def pead():
+@recorder.timed
+def pead(as_of=None):
     """
     Creates the data for the Post Earnings Announcement Drift strategy
     Steps:
@@ -178,10 +277,12 @@ def pead():
     5) Calculate unexpected earnings
     6) Calculate standardized unexpected earnings
     7) Create ranking and signal
+    :param as_of: date of the signals, only data known at that date is used (None: all data, the signals are saved for
+                  the app)
     :return: DataFrame indicating which stocks to long and short
     """
     # load data
-    df = pd.read_parquet("./data/financial_statements_annual.parquet.gzip")
+    df = data_context.financials(columns=['cik', 'year', 'ticker', 'EarningsPerShareBasic'], as_of=as_of)
 
     # set stock as index
     df.index = df['ticker']
@@ -194,12 +295,12 @@ def pead():
     df = df.dropna(subset=['EarningsPerShareBasic'])
 
     # only keep companies with at least 3 annual statements
-    df = df.groupby('cik').filter(lambda x: len(x) > 3)
+    df = df[df.groupby('cik')['cik'].transform('size') > 3]
 
     # for every company get the previous 4 years mean and std
     df['count'] = df.groupby('cik').cumcount(ascending=False)
     last_4_df = df[(df.loc[:, 'count'] <= 4) & (df.loc[:, 'count'] > 0)]
-    last_4_df = last_4_df.groupby('ticker')['EarningsPerShareBasic'].agg(['mean', 'std'])
+    last_4_df = last_4_df.groupby('ticker', observed=True)['EarningsPerShareBasic'].agg(['mean', 'std'])
 
     # for every company keep the latest values
     df = df.sort_values('year', ascending=False).drop_duplicates('cik').sort_index()
@@ -214,18 +315,22 @@ def pead():
     df['sue'] = df['unexpected_earnings']/df['std']
 
     # create rank
-    df['decile_rank'] = pd.qcut(df['sue'], 10, labels=False)
+    with recorder.stage('ranking', rows=len(df)):
+        df['decile_rank'] = pd.qcut(df['sue'], 10, labels=False)
 
     # filter for winners and losers and rename
     df = df[df.loc[:, 'decile_rank'].isin([0, 9])]
     df['Signal'] = np.where(df['decile_rank'] == 0, 'Short', 'Long')
     df = df[['Signal']]
     df.index.name = 'Stock'
-    df.to_excel('./data/pead.xlsx')
+    # only the signals of today are shown in the app
+    if as_of is None:
+        df.to_excel('./data/pead.xlsx')
     return df
 
 
-def momentum(lookback_period=12):
+@recorder.timed
+def momentum(lookback_period=12, monthly=None, as_of=None):
     """
     Creates the data for the momentum strategy.
     Steps:
@@ -237,21 +342,14 @@ def momentum(lookback_period=12):
     6) calculate average return over last 12 month
     7) Create rank and keep first and last decile
     :param lookback_period: lookback period for momentum strategy
+    :param monthly: monthly returns (see monthly_returns), None to calculate them
+    :param as_of: date of the signals, only data known at that date is used (None: all data, the signals are saved for
+                  the app)
     :return: DataFrame indicating which stocks to long and short
     """
 
-    # load data
-    df = pd.read_parquet('./data/stock_returns.parquet.gzip')
-
-    # drop columns with all #NA and last rows #NA --> not tradeable anymore
-    df = df.dropna(axis=1, how='all')
-    df = df.dropna(axis=1, subset=[df.index[-5]], how='all')
-
-    # daily return
-    df = df.pct_change()
-
-    # monthly return
-    df = df.resample('M').agg(lambda x: (x + 1).prod() - 1)
+    # load data and calculate monthly return
+    df = monthly if monthly is not None else monthly_returns(as_of=as_of)
 
     # keep last 12 month
     df = df.tail(n=lookback_period)
@@ -263,135 +361,190 @@ def momentum(lookback_period=12):
     df = df.mean(axis=0).to_frame('avg_return')
 
     # create rank
-    df['decile_rank'] = pd.qcut(df['avg_return'], 10, labels=False)
+    with recorder.stage('ranking', rows=len(df)):
+        df['decile_rank'] = pd.qcut(df['avg_return'], 10, labels=False)
 
     # filter for winners and losers and rename
     df = df[df.loc[:, 'decile_rank'].isin([0, 9])]
     df['Signal'] = np.where(df['decile_rank'] == 0, 'Short', 'Long')
     df = df[['Signal']]
     df.index.name = 'Stock'
-    df.to_excel('./data/momentum.xlsx')
+    # only the signals of today are shown in the app
+    if as_of is None:
+        df.to_excel('./data/momentum.xlsx')
     return df
 
 
-def g_score():
+@recorder.timed
+def momentum_signals(lookback_period=12, monthly=None):
+    """
+    Creates the signals of the momentum strategy for every month at once (same ranking as momentum for the latest
+    month), p.e. for a backtest.
+    :param lookback_period: lookback period for momentum strategy
+    :param monthly: monthly returns (see monthly_returns), None to calculate them
+    :return: DataFrame (months x stocks) with 1 for long, -1 for short and 0 for no position
+    """
+    df = monthly if monthly is not None else monthly_returns()
+
+    # average return of the lookback period without the latest month, for every month
+    avg_return = df.shift(1).rolling(lookback_period - 1).mean()
+
+    # first and last decile of every month (same edges as pd.qcut)
+    signals = quantile_signals(avg_return.to_numpy(), 0.1)
+    return pd.DataFrame(signals, index=df.index, columns=df.columns)
+
+
+@recorder.timed
+def g_score(btm=None, as_of=None, sic_digits=None, fallback=None):
     """
     Creates the data for the G-Score strategy
     Steps:
     1) Load annual SEC data
     2) Load book to market ratios and only keep lowest quantile
     3) Calculate scores
-    4) Create 2-digit-SIC code
+    4) Group companies into industries by the first digits of the SIC code (default: 2)
     5) Only keep industries with at least 4 companies in it
     6) Calculate final score
     7) Create signal
+    :param btm: book to market ratios (see book_to_market), None to calculate them
+    :param as_of: date of the signals, only data known at that date is used (None: all data, the signals are saved for
+                  the app)
+    :param sic_digits: number of digits of the SIC codes of the industries (2, 3 or 4), None for g_score_sic_digits
+    :param fallback: True to compare companies of small industries with the coarser levels, None for g_score_fallback
     :return: DataFrame indicating which stocks to long and short
     """
+    sic_digits = sic_digits if sic_digits is not None else g_score_sic_digits
+    fallback = fallback if fallback is not None else g_score_fallback
 
-    # load data
-    df = pd.read_parquet("./data/financial_statements_annual.parquet.gzip")
+    # load data, the variances of RoA and sales growth are calculated over all years of a company
+    df = data_context.financials(columns=g_score_columns, as_of=as_of)
 
     # create book to market ratio
-    btm = book_to_market()
+    if btm is None:
+        btm = book_to_market(as_of)
 
-    # keep last quantile
-    btm['quantile_rank'] = pd.qcut(btm['book_to_market'], 5, labels=False)
+    # keep last quantile (ranked on a copy, the book to market data is shared with other strategies)
+    btm = btm.assign(quantile_rank=pd.qcut(btm['book_to_market'], 5, labels=False))
     btm = btm[btm.loc[:, 'quantile_rank'] == 0]
 
     # keep companies in lowest quantile in financial DataFrame
     df = df.merge(btm, how='inner', left_on='ticker', right_index=True)
 
-    # create sic 2 digit code
-    df['sic'] = df['sic'].astype(int).astype(str)
-    df['sic'] = df['sic'].apply(lambda x: '{0:0>4}'.format(x))
-    df['sic_2_digits'] = df['sic'].str[:2]
+    df = g_score_measures(df)
 
-    # calculate avg assets last two years
-    df['assets_avg'] = df.groupby('cik', sort=False)['Assets'].apply(
-        lambda x: ((x+x.shift())/2)).to_numpy()
-    # first year for every company --> keep assets of that year
-    df['assets_avg'] = df['assets_avg'].fillna(df['Assets'])
+    # for every company keep the latest values
+    df = df.sort_values('year', ascending=False).drop_duplicates('cik').sort_index()
 
-    # calculate avg assets last two years
-    df['assets_begin'] = df.groupby('cik', sort=False)['Assets'].apply(
-        lambda x: (x.shift())).to_numpy()
+    # industry medians and sizes of the SIC codes, only keep industries with at least 4 companies
+    # (removing whole industries does not change the medians of the other industries)
+    df = df.join(g_scores(df, sic_digits, fallback))
+    df = df[df.loc[:, 'industry_size'] >= industry_min_size]
 
-    # calculate RoA
-    df['RoA'] = df['OperatingIncomeLoss']/df['assets_avg']
+    # remove companies with too many missing values
+    df = df[df.loc[:, 'missing_values'] < 4]
 
-    # calculate RoA std per company
-    df['RoA_var'] = df.groupby('cik')['RoA'].transform('std')
+    # create signal
+    df['Signal'] = np.where(df['score'] >= 6, 'Long', np.where(df['score'] <= 2, 'Short', np.nan))
+    df = df[df.loc[:, 'Signal'].isin(['Long', 'Short'])]
+    df.index = df['ticker']
+    df.index.name = 'Stock'
+    df = df['Signal']
 
-    # calculate CFO
-    df['CFO'] = df['NetCashProvidedByUsedInOperatingActivities']/df['assets_avg']
+    # only the signals of today are shown in the app
+    if as_of is None:
+        df.to_excel('./data/g_score.xlsx')
+    return df
 
-    # calculate sales (revenue) growth per company
-    df['Revenues'] = df['Revenues'].fillna(df['RevenueFromContractWithCustomerExcludingAssessedTax'])
-    df['Sales_growth'] = df.groupby('cik')['Revenues'].pct_change()
-    df['Sales_growth_var'] = df.groupby('cik')['Sales_growth'].transform('std')
 
-    # for every company keep the latest values
-    df = df.sort_values('year', ascending=False).drop_duplicates('cik').sort_index()
+# columns of the annual data for the G-Score
+g_score_columns = ['year', 'cik', 'sic', 'ticker', 'Assets', 'OperatingIncomeLoss',
+                   'NetCashProvidedByUsedInOperatingActivities', 'Revenues',
+                   'RevenueFromContractWithCustomerExcludingAssessedTax', 'ResearchAndDevelopmentExpense',
+                   'PaymentsToAcquirePropertyPlantAndEquipment', 'SellingGeneralAndAdministrativeExpense']
 
-    # only keep industries with at least 4 companies
-    df = df.groupby('sic_2_digits').filter(lambda x: len(x) > 4)
 
-    # score 1 - RoA
-    df['RoA_median_industry'] = df.groupby('sic_2_digits')['RoA'].transform('median')
-    df['score_1'] = np.where(df['RoA'] > df['RoA_median_industry'], 1, 0)
+def g_score_measures(df, expanding=False):
+    """
+    Calculates the measures of the 8 G-Score criteria for every company and year.
+    :param df: annual data with the columns of g_score_columns
+    :param expanding: False for the variances of all statements of a company, True for the variances of the statements
+                      until every statement (no look ahead for a history of the scores)
+    :return: DataFrame with the measures as additional columns
+    """
+    panel = CompanyPanel(df)
 
-    # score 2 - CFO
-    df['CFO_median_industry'] = df.groupby('sic_2_digits')['CFO'].transform('median')
-    df['score_2'] = np.where(df['CFO'] > df['CFO_median_industry'], 1, 0)
+    # calculate avg assets last two years and assets beginning of the year
+    df = df.join(panel.features(df, averages={'assets_avg': 'Assets'}, lags={'assets_begin': 'Assets'}))
+    # first year for every company --> keep assets of that year
+    df['assets_avg'] = df['assets_avg'].fillna(df['Assets'])
 
-    # score 3 - Accruals
-    df['accrual'] = df['RoA']-df['CFO']
-    df['score_3'] = np.where(df['CFO'] > df['RoA'], 1, 0)
+    def std(values):
+        return panel.expanding_std(values) if expanding else values.groupby(df['cik']).transform('std')
 
-    # score 4 - Variance RoA
-    df['RoA_std_median_industry'] = df.groupby('sic_2_digits')['RoA_var'].transform('median')
-    df['score_4'] = np.where(df['RoA_var'] < df['RoA_std_median_industry'], 1, 0)
+    # calculate RoA and RoA std per company
+    df['RoA'] = df['OperatingIncomeLoss']/df['assets_avg']
+    df['RoA_var'] = std(df['RoA'])
 
-    # score 5 - Variance Sales Growth
-    df['Sales_growth_var_industry'] = df.groupby('sic_2_digits')['Sales_growth_var'].transform('median')
-    df['score_5'] = np.where(df['Sales_growth_var'] < df['Sales_growth_var_industry'], 1, 0)
+    # calculate CFO and accruals
+    df['CFO'] = df['NetCashProvidedByUsedInOperatingActivities']/df['assets_avg']
+    df['accrual'] = df['RoA']-df['CFO']
 
-    # score 6 - R&D intensity
-    df['RaD_intensity'] = df['ResearchAndDevelopmentExpense']/df['assets_begin']
-    df['RaD_median_industry'] = df.groupby('sic_2_digits')['RaD_intensity'].transform('median')
-    df['score_6'] = np.where(df['RaD_intensity'] > df['RaD_median_industry'], 1, 0)
+    # calculate sales (revenue) growth per company
+    df['Revenues'] = df['Revenues'].fillna(df['RevenueFromContractWithCustomerExcludingAssessedTax'])
+    df['Sales_growth'] = panel.pct_change(df['Revenues'])
+    df['Sales_growth_var'] = std(df['Sales_growth'])
 
-    # score 7 - capital expenditure intensity
+    # R&D, capital expenditure and advertising expense intensity
+    df['RaD_intensity'] = df['ResearchAndDevelopmentExpense']/df['assets_begin']
     df['capex'] = df['PaymentsToAcquirePropertyPlantAndEquipment']/df['assets_begin']
-    df['capex_median_industry'] = df.groupby('sic_2_digits')['capex'].transform('median')
-    df['score_7'] = np.where(df['capex'] > df['capex_median_industry'], 1, 0)
-
-    # score 8 - advertising expense intensity
     df['ads'] = df['SellingGeneralAndAdministrativeExpense']/df['assets_begin']
-    df['ads_median_industry'] = df.groupby('sic_2_digits')['ads'].transform('median')
-    df['score_8'] = np.where(df['ads'] > df['ads_median_industry'], 1, 0)
+    return df
 
-    # count number of missing values and remove big numbers
-    df['missing_values'] = df[['RoA', 'CFO', 'accrual', 'RoA_var', 'Sales_growth_var',
-                               'RaD_intensity', 'capex', 'ads']].isnull().sum(axis=1)
-    df = df[df.loc[:, 'missing_values'] < 4]
 
-    # final score
-    df['score'] = df['score_1']+df['score_2']+df['score_3']+df['score_4']+df['score_5']+df['score_6']+\
-                  df['score_7']+df['score_8']
+def g_scores(df, sic_digits=2, fallback=False, years=False):
+    """
+    Evaluates the 8 criteria of every company as one boolean matrix, the industry medians of all measures come out of
+    the sorted integer SIC codes (see industries.industry_medians).
+    :param df: data with the sic column and the measures (see g_score_measures)
+    :param sic_digits: number of digits of the SIC codes of the industries, 2, 3 or 4
+    :param fallback: True to compare companies of small industries with the coarser levels
+    :param years: True to only compare companies of the same year, p.e. for a history of the scores
+    :return: DataFrame with the G-Score, the number of missing measures, the number of companies in the industry and
+             the number of digits of the industry
+    """
+    measures = df[[measure for measure, _, _ in g_score_criteria]].to_numpy(dtype=float)
+    medians, sizes, digits = industry_medians(measures, df['sic'].to_numpy(dtype=float, na_value=np.nan), sic_digits,
+                                              fallback, groups=df['year'].to_numpy(dtype=np.int64) if years else None)
+    # criteria compared to 0 instead of the industry median
+    relative = np.array([industry for _, _, industry in g_score_criteria])
+    thresholds = np.where(relative, medians, 0)
 
-    # create signal
-    df['Signal'] = np.where(df['score'] >= 6, 'Long', np.where(df['score'] <= 2, 'Short', np.nan))
-    df = df[df.loc[:, 'Signal'].isin(['Long', 'Short'])]
-    df.index = df['ticker']
-    df.index.name = 'Stock'
-    df = df['Signal']
+    scores, missing = score(measures, thresholds, [comparison for _, comparison, _ in g_score_criteria])
+    return pd.DataFrame({'score': scores, 'missing_values': missing, 'industry_size': sizes,
+                         'industry_digits': digits}, index=df.index)
 
-    df.to_excel('./data/g_score.xlsx')
-    return df
 
+@recorder.timed
+def g_score_history(as_of=None, sic_digits=None, fallback=None):
+    """
+    G-Score of every company and year, p.e. for a backtest (without the book to market filter of the strategy). The
+    industry medians are the ones of the companies of the same year, the variances only use the statements until the
+    year.
+    :param as_of: only statements filed until this date, None for all statements
+    :param sic_digits: number of digits of the SIC codes of the industries, None for g_score_sic_digits
+    :param fallback: True to compare companies of small industries with the coarser levels, None for g_score_fallback
+    :return: DataFrame with year, cik, ticker, SIC code, G-Score, number of missing measures, number of companies and
+             number of digits of the industry of every annual statement
+    """
+    sic_digits = sic_digits if sic_digits is not None else g_score_sic_digits
+    fallback = fallback if fallback is not None else g_score_fallback
+    df = g_score_measures(data_context.financials(columns=g_score_columns, as_of=as_of), expanding=True)
+    df = df.join(g_scores(df, sic_digits, fallback, years=True))
+    return df[['year', 'cik', 'ticker', 'sic', 'score', 'missing_values', 'industry_size', 'industry_digits']]
 
-def accrual_anatomy():
+
+@recorder.timed
+def accrual_anatomy(as_of=None):
     """
     Creates the data for the accrual anatomy strategy
     Steps:
@@ -404,26 +557,26 @@ def accrual_anatomy():
     7) Calculate accruals
     8) Calculate income rate, cash rate, accrual rate
     9) Create Signal based on cash component
+    :param as_of: date of the signals, only data known at that date is used (None: all data, the signals are saved for
+                  the app)
     :return: DataFrame indicating which stocks to long and short
     """
 
     # load data
-    df = pd.read_parquet("./data/financial_statements_annual.parquet.gzip")
+    df = data_context.financials(columns=['year', 'cik', 'name', 'ticker', 'Assets', 'AssetsCurrent',
+                                          'CashAndCashEquivalentsAtCarryingValue', 'LiabilitiesCurrent',
+                                          'IncomeTaxesPaid', 'DepreciationDepletionAndAmortization',
+                                          'OperatingIncomeLoss'], as_of=as_of)
 
-    # create delta columns
     df = df.sort_values(['year', 'cik']).reset_index(drop=True)
-    df['Delta_Assets'] = df.groupby('cik', sort=False)['AssetsCurrent'].apply(
-        lambda x: x - x.shift()).to_numpy()
-    df['Delta_Cash'] = df.groupby('cik', sort=False)['CashAndCashEquivalentsAtCarryingValue'].apply(
-        lambda x: x - x.shift()).to_numpy()
-    df['Delta_Liab'] = df.groupby('cik', sort=False)['LiabilitiesCurrent'].apply(
-        lambda x: x - x.shift()).to_numpy()
-    df['Delta_Taxes'] = df.groupby('cik', sort=False)['IncomeTaxesPaid'].apply(
-        lambda x: x - x.shift()).to_numpy()
-
-    # Create assets AVG column
-    df['AVG_Assets'] = df.groupby('cik', sort=False)['Assets'].apply(
-        lambda x: (x + x.shift()) / 2).to_numpy()
+
+    # create delta columns and assets AVG column
+    features = CompanyPanel(df).features(df, deltas={'Delta_Assets': 'AssetsCurrent',
+                                                     'Delta_Cash': 'CashAndCashEquivalentsAtCarryingValue',
+                                                     'Delta_Liab': 'LiabilitiesCurrent',
+                                                     'Delta_Taxes': 'IncomeTaxesPaid'},
+                                         averages={'AVG_Assets': 'Assets'})
+    df = df.join(features)
 
     # keep needed columns
     df = df[['year', 'cik', 'name', 'ticker', 'Delta_Assets', 'Delta_Cash', 'Delta_Liab', 'Delta_Taxes',
@@ -446,7 +599,8 @@ def accrual_anatomy():
     df['Cash_Component'] = df['Income_Rate'] - df['Accrual_Component']
 
     # create rank
-    df['decile_rank'] = pd.qcut(df['Cash_Component'], 10, labels=False)
+    with recorder.stage('ranking', rows=len(df)):
+        df['decile_rank'] = pd.qcut(df['Cash_Component'], 10, labels=False)
 
     # filter for winners and losers and rename
     df = df[df.loc[:, 'decile_rank'].isin([0, 9])]
@@ -454,40 +608,82 @@ def accrual_anatomy():
     df.index = df['ticker']
     df = df[['Signal']]
     df.index.name = 'Stock'
-    df.to_excel('./data/accruals.xlsx')
+    # only the signals of today are shown in the app
+    if as_of is None:
+        df.to_excel('./data/accruals.xlsx')
     return df
 
 
-def betting_against_beta(start_date):
+@recorder.timed
+def market_index(start_date, source=None, as_of=None):
+    """
+    Daily returns of the market index, only out of local data (no download): the same index gives the same betas on
+    every run.
+    :param start_date: first date of the index
+    :param source: ticker of the index in the price store, 'cap_weighted' or a Series with the close prices of an index,
+                   None for market_index_source
+    :param as_of: only returns until this date, None for all returns
+    :return: Series with the daily returns of the index
+    """
+    source = source if source is not None else market_index_source
+
+    if isinstance(source, pd.Series):
+        prices = source[source.index >= pd.Timestamp(start_date, tz=source.index.tz)]
+    elif source == 'cap_weighted':
+        # number of shares of the latest annual statement of every company
+        df = data_context.financials(columns=['year', 'ticker', 'WeightedAverageNumberOfSharesOutstandingBasic'],
+                                     last_years=2, as_of=as_of).dropna()
+        df = df.sort_values('year').drop_duplicates('ticker', keep='last')
+        shares = pd.Series(df['WeightedAverageNumberOfSharesOutstandingBasic'].to_numpy(),
+                           index=df['ticker'].astype(str))
+        stock_prices = data_context.stock_prices(as_of)
+        prices = cap_weighted_index(stock_prices[stock_prices.index >= pd.Timestamp(start_date)], shares)
+    else:
+        prices = data_context.stored_prices([source], start=start_date, as_of=as_of)[source].dropna()
+        if len(prices) == 0:
+            raise ValueError(f'{source} is not in the price store, run create_data.get_stock_returns first or use '
+                             f'another market index source')
+
+    if as_of is not None:
+        prices = prices[prices.index <= pd.Timestamp(as_of, tz=prices.index.tz)]
+    return prices.pct_change()
+
+
+@recorder.timed
+def betting_against_beta(start_date, daily=None, window=None, as_of=None, market=None, expanding=None):
     """
     Creates the data for the betting against beta strategy.
     Steps:
-    1) Load the Wilshere 5000 data as market index and calculate return
+    1) Load the market index (default: Wilshere 5000) and calculate return
     2) Load stock data and calculate return
-    3) Calculate beta by dividing covariance from stock and market by variance from market
+    3) Calculate beta by dividing covariance from stock and market by variance from market (both on the days with stock
+       and market returns)
     4) Create long and short signals: long --> stock over median, short --> stock under median
-    :param start_date: Date to pull Wilshere 5000 data from
+    :param start_date: Date to pull the market index from
+    :param daily: daily returns (see daily_returns), None to calculate them
+    :param window: number of days for the beta (p.e. 756 for 36 months), None for all days since the start date
+    :param as_of: date of the signals, only data known at that date is used (None: all data, the signals are saved for
+                  the app)
+    :param market: source of the market index (see market_index), None for market_index_source
+    :param expanding: stats.ExpandingBetas with the sums of earlier dates (p.e. of a walk forward), None to calculate
+                      the betas out of all days (only used without window)
     :return: DataFrame indicating which stocks to long and short
     """
 
     # market data
-    tick = yf.Ticker('^W5000')
-    wilshere5000 = tick.history(start=start_date)
-    wilshere5000 = wilshere5000.pct_change()
-    var_market = wilshere5000['Close'].var()
-
-    # load data
-    df = pd.read_parquet('./data/stock_returns.parquet.gzip')
-
-    # drop columns with all #NA and last rows #NA --> not tradeable anymore
-    df = df.dropna(axis=1, how='all')
-    df = df.dropna(axis=1, subset=[df.index[-5]], how='all')
-
-    # daily return
-    df = df.pct_change()
-
-    # calculate beta for each stock
-    beta = pd.Series({symbol: wilshere5000['Close'].cov(df[symbol]) for symbol in df}) / var_market
+    market_returns = market_index(start_date, market, as_of)
+
+    # load data and calculate daily return
+    df = daily if daily is not None else daily_returns(as_of)
+
+    # calculate beta for all stocks at once, with a window the beta of the last day
+    with recorder.stage('beta', rows=df.shape[1]):
+        if window is None and expanding is not None:
+            beta = expanding.betas(df, market_returns)
+        elif window is None:
+            beta = betas(df, market_returns)
+        else:
+            beta = betas(df, market_returns, window).iloc[-1]
     beta = beta.to_frame('beta')
 
     # create signal
@@ -495,11 +691,14 @@ def betting_against_beta(start_date):
     beta['Signal'] = np.where(beta['beta'] >= median, 'Short', 'Long')
     beta = beta[['Signal']]
     beta.index.name = 'Stock'
-    beta.to_excel('./data/beta.xlsx')
+    # only the signals of today are shown in the app
+    if as_of is None:
+        beta.to_excel('./data/beta.xlsx')
     return beta
 
 
-def equity_pairs():
+@recorder.timed
+def equity_pairs(monthly=None, as_of=None):
     """
     Creates the data for the equity pairs strategy.
     Steps:
@@ -510,65 +709,58 @@ def equity_pairs():
     5) Calculate expected return by taking average return of 50 stocks with highest correlation
     6) Take the difference between actual and expected return for every stock
     7) Create decile and short biggest positive difference and long biggest negative difference
+    :param monthly: monthly returns (see monthly_returns), None to calculate them
+    :param as_of: date of the signals, only data known at that date is used (None: all data, the signals are saved for
+                  the app)
     :return: DataFrame indicating which stocks to long and short
     """
-    # load data
-    df = pd.read_parquet('./data/stock_returns.parquet.gzip')
+    # load data and calculate monthly return
+    df = monthly if monthly is not None else monthly_returns(as_of=as_of)
 
-    # drop columns with all #NA and last rows #NA --> not tradeable anymore
-    df = df.dropna(axis=1, how='all')
-    df = df.dropna(axis=1, subset=[df.index[-5]], how='all')
-
-    # daily return
-    df = df.pct_change()
-
-    # monthly return
-    df = df.resample('M').agg(lambda x: (x + 1).prod() - 1)
-
-    # calculate correlation
-    corr = df.corr()
-    corr = corr.unstack().reset_index()
-    corr.columns = ['stock1', 'stock2', 'correlation']
-    # delete correlation from stock with itself
-    corr = corr[corr['stock1'] != corr['stock2']]
-    # only keep top 50
-    corr['rank'] = corr.groupby(['stock1'])['correlation'].rank(ascending=False)
-    corr = corr[corr.loc[:, 'rank'] <= 50]
+    # calculate correlation and keep the top 50 partners of every stock (without the stock itself)
+    with recorder.stage('correlation', rows=df.shape[1]):
+        partners, _ = top_correlations(df, 50)
 
     # drop last month
     df = df[:-1]
 
     # keep last full month
-    last_month = df.tail(n=1).T
-    last_month.columns = ['exp_return']
-    last_month.index.name = 'stock'
+    last_month = df.iloc[-1].to_numpy()
 
-    # merge correlation with last month and calculate average return
-    corr = corr.merge(last_month, left_on='stock2', right_index=True, how='left')
-    corr = corr.groupby(['stock1'])['exp_return'].mean().to_frame()
+    # average return of the partners in the last month
+    partner_returns = pd.DataFrame(np.where(partners >= 0, last_month[partners], np.nan), index=df.columns)
+    corr = pd.DataFrame({'exp_return': partner_returns.mean(axis=1), 'actual_return': last_month}).sort_index()
 
-    # merge actual return last month and calculate difference
-    last_month.columns = ['actual_return']
-    corr = corr.merge(last_month, left_on='stock1', right_index=True, how='left')
+    # calculate difference
     corr['difference'] = corr['actual_return'] - corr['exp_return']
-    corr['decile_rank'] = pd.qcut(corr['difference'], 10, labels=False)
+    with recorder.stage('ranking', rows=len(corr)):
+        corr['decile_rank'] = pd.qcut(corr['difference'], 10, labels=False)
 
     # filter for winners and short and long
     corr = corr[corr.loc[:, 'decile_rank'].isin([0, 9])]
     corr['Signal'] = np.where(corr['decile_rank'] == 0, 'Long', 'Short')
     corr = corr[['Signal']]
     corr.index.name = 'Stock'
-    corr.to_excel('./data/equity_pairs.xlsx')
+    # only the signals of today are shown in the app
+    if as_of is None:
+        corr.to_excel('./data/equity_pairs.xlsx')
     return corr
 
 
-f_score()
-pead()
-momentum()
-g_score()
-accrual_anatomy()
-betting_against_beta('2015-01-01')
-equity_pairs()
-
-
+@recorder.timed
+def pairs_correlations(lookbacks=(12, 36, 60), workers=4, monthly=None, folder='./data/correlations'):
+    """
+    Writes the full correlation matrices of the monthly returns for the research on the equity pairs strategy, one
+    memory-mapped file for every lookback period (p.e. ./data/correlations/correlations_36m.npy). The files can be
+    opened with read_correlations without reading the whole matrix.
+    :param lookbacks: lookback periods in months
+    :param workers: number of threads calculating the tiles of a matrix
+    :param monthly: monthly returns (see monthly_returns), None to calculate them
+    :param folder: folder of the files
+    :return: dict with lookback period and read-only memory-mapped correlation matrix
+    """
+    df = monthly if monthly is not None else monthly_returns()
+    os.makedirs(folder, exist_ok=True)
+    return {lookback: write_correlations(df.tail(n=lookback), f'{folder}/correlations_{lookback}m.npy',
+                                         workers=workers) for lookback in lookbacks}
 
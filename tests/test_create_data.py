@@ -0,0 +1,105 @@
+import os
+import zipfile
+import numpy as np
+import pandas as pd
+import pytest
+import benchmark
+import create_data
+
+# quarters of the synthetic data (fiscal quarter and folder of the filings), a 10-K and a 10-Q quarter
+test_quarters = [(2019, 4, '2020q1'), (2020, 1, '2020q2')]
+
+
+@pytest.fixture
+def data_folder(tmp_path, monkeypatch):
+    """
+    Writes a ticker file and two quarters of synthetic SEC data into ./data of a temporary working folder.
+    :return: path of the data folder
+    """
+    monkeypatch.chdir(tmp_path)
+    folder = tmp_path / 'data'
+    folder.mkdir()
+    rng = np.random.default_rng(0)
+    df_companies = benchmark.generate_companies(300)
+    benchmark.generate_ticker_file(folder / 'ticker.txt', df_companies)
+    for year, quarter, name in test_quarters:
+        sub, num = benchmark.generate_quarter(df_companies, year, quarter, np.ones(len(df_companies)), rng)
+        (folder / name).mkdir()
+        sub.to_csv(folder / name / 'sub.txt', sep='\t', index=False)
+        num.to_csv(folder / name / 'num.txt', sep='\t', index=False)
+    return folder
+
+
+def zip_quarters(folder):
+    """
+    Replaces the quarter folders by zip archives in the format of the SEC downloads.
+    :param folder: data folder
+    """
+    for _, _, name in test_quarters:
+        with zipfile.ZipFile(folder / f'{name}.zip', 'w') as archive:
+            for file in ['sub.txt', 'num.txt']:
+                archive.write(folder / name / file, file)
+                os.remove(folder / name / file)
+        os.rmdir(folder / name)
+
+
+def test_zip_and_folder_give_the_same_data(data_folder):
+    ticker = create_data.load_ticker()
+    from_folders = create_data.read_quarters(ticker, create_data.tags)
+    zip_quarters(data_folder)
+    assert list(create_data.list_quarters().values()) == [f'{name}.zip' for _, _, name in test_quarters]
+    from_zips = create_data.read_quarters(ticker, create_data.tags)
+
+    for kind in ['annual', 'quarterly']:
+        assert len(from_folders[kind]) > 0
+        pd.testing.assert_frame_equal(from_folders[kind], from_zips[kind])
+
+
+def test_chunked_read_num(data_folder):
+    path = data_folder / test_quarters[0][2] / 'num.txt'
+    whole = create_data.read_num(path, create_data.tags)
+    # the smallest budget reads the rest of the file in chunks of 1000 rows
+    chunked = create_data.read_num(path, create_data.tags, memory_budget=1)
+
+    assert len(pd.read_csv(path, sep='\t')) > 10000
+    assert set(whole['tag']) <= set(create_data.tags)
+    pd.testing.assert_frame_equal(whole, chunked)
+
+
+@pytest.mark.parametrize('zipped', [False, True])
+def test_workers_give_the_same_data(data_folder, zipped):
+    if zipped:
+        zip_quarters(data_folder)
+    ticker = create_data.load_ticker()
+    sources = list(create_data.list_quarters().values())
+    one = create_data.transform_quarters(sources, ticker, create_data.tags, workers=1, memory_budget=1)
+    three = create_data.transform_quarters(sources, ticker, create_data.tags, workers=3, memory_budget=1)
+
+    for frame_one, frame_three in zip(one, three):
+        for kind in ['annual', 'quarterly']:
+            pd.testing.assert_frame_equal(frame_one[kind], frame_three[kind])
+
+
+def test_manifest_only_transforms_new_and_changed_quarters(data_folder, monkeypatch):
+    transformed = []
+    transform_quarters = create_data.transform_quarters
+
+    def recorded(sources, *args, **kwargs):
+        transformed.append(list(sources))
+        return transform_quarters(sources, *args, **kwargs)
+
+    monkeypatch.setattr(create_data, 'transform_quarters', recorded)
+    ticker = create_data.load_ticker()
+    first = create_data.read_quarters(ticker, create_data.tags, incremental=True)
+    second = create_data.read_quarters(ticker, create_data.tags, incremental=True)
+
+    # a changed num file is transformed again
+    num_path = data_folder / test_quarters[1][2] / 'num.txt'
+    os.utime(num_path, ns=(0, 0))
+    third = create_data.read_quarters(ticker, create_data.tags, incremental=True)
+
+    assert transformed == [['2020q1', '2020q2'], [], ['2020q2']]
+    assert sorted(create_data.load_manifest()['folders']) == ['2020q1', '2020q2']
+    for kind in ['annual', 'quarterly']:
+        pd.testing.assert_frame_equal(first[kind], second[kind])
+        pd.testing.assert_frame_equal(first[kind], third[kind])
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import pytest
+import prices
+from prices import LocalPriceProvider, PriceStore, fetch_prices
+
+
+class RecordingProvider(LocalPriceProvider):
+    """
+    Local price provider that records every request and fails the first requests.
+    """
+
+    def __init__(self, prices, failures=0):
+        """
+        :param prices: DataFrame with the close prices, one column per ticker
+        :param failures: number of requests that raise an error before the first answer
+        """
+        super().__init__(prices)
+        self.requests = []
+        self.failures = failures
+
+    def history(self, ticker, start, end=None):
+        self.requests.append((ticker, start, end))
+        if len(self.requests) <= self.failures:
+            raise ConnectionError('no connection')
+        return super().history(ticker, start, end)
+
+
+@pytest.fixture
+def df_prices():
+    """
+    :return: business day prices of 2020 and 2021, DEAD stops trading at the end of June 2020
+    """
+    dates = pd.bdate_range('2020-01-01', '2021-12-31', name='Date')
+    df = pd.DataFrame({'AAA': np.linspace(10, 20, len(dates)), 'DEAD': np.linspace(5, 1, len(dates))}, index=dates)
+    df.loc[df.index > '2020-06-30', 'DEAD'] = np.nan
+    return df
+
+
+def test_only_missing_ranges_are_requested(tmp_path, df_prices):
+    provider = RecordingProvider(df_prices)
+    store = PriceStore(tmp_path, provider)
+    assert store.update(['AAA'], '2021-01-01', '2021-07-01') == 1
+
+    # earlier and later days are requested, the covered range is not requested again
+    provider.requests.clear()
+    assert store.update(['AAA'], '2020-07-01', '2022-01-01') == 2
+    assert provider.requests == [('AAA', '2020-07-01', '2021-01-01'), ('AAA', '2021-07-01', '2022-01-01')]
+    assert store.update(['AAA'], '2020-07-01', '2022-01-01') == 0
+
+    # the store is saved and the prices are the prices of the provider
+    stored = PriceStore(tmp_path, provider).prices(['AAA'], '2020-07-01', '2022-01-01')
+    pd.testing.assert_series_equal(stored['AAA'], df_prices.loc['2020-07-01':, 'AAA'], check_freq=False)
+
+
+def test_status_of_tickers_without_data_and_delisted_tickers(tmp_path, df_prices):
+    provider = RecordingProvider(df_prices)
+    store = PriceStore(tmp_path, provider)
+    store.update(['AAA', 'DEAD', 'NONE'], '2020-03-01', '2021-01-01')
+    assert store.coverage['status'].to_dict() == {'AAA': 'ok', 'DEAD': 'delisted', 'NONE': 'no_data'}
+    assert store.coverage.at['DEAD', 'last_price'] == pd.Timestamp('2020-06-30')
+
+    # no new prices are requested for them until the recheck, earlier prices still are
+    provider.requests.clear()
+    store.update(['AAA', 'DEAD', 'NONE'], '2020-01-01', '2021-07-01')
+    assert sorted(provider.requests) == [('AAA', '2020-01-01', '2020-03-01'), ('AAA', '2021-01-01', '2021-07-01'),
+                                         ('DEAD', '2020-01-01', '2020-03-01'), ('NONE', '2020-01-01', '2020-03-01')]
+    assert store.prices(['DEAD'])['DEAD'].first_valid_index() == pd.Timestamp('2020-01-01')
+
+    # after the recheck they are requested again
+    store.coverage['checked'] = pd.Timestamp.today().normalize() - pd.Timedelta(days=31)
+    provider.requests.clear()
+    store.update(['DEAD', 'NONE'], '2020-01-01', '2022-01-01')
+    assert sorted(provider.requests) == [('DEAD', '2021-01-01', '2022-01-01'), ('NONE', '2021-01-01', '2022-01-01')]
+
+
+def test_failed_requests_are_repeated_with_growing_waits(monkeypatch, df_prices):
+    waits = []
+    monkeypatch.setattr(prices.time, 'sleep', waits.append)
+
+    provider = RecordingProvider(df_prices, failures=2)
+    result = fetch_prices(provider, 'AAA', '2021-01-01', '2021-02-01', retries=3, backoff=0.5)
+    assert waits == [0.5, 1.0]
+    assert len(provider.requests) == 3
+    assert len(result) == len(df_prices.loc['2021-01-01':'2021-01-31'])
+
+    # all requests fail --> None
+    waits.clear()
+    provider = RecordingProvider(df_prices, failures=10)
+    assert fetch_prices(provider, 'AAA', '2021-01-01', retries=2, backoff=1.0) is None
+    assert waits == [1.0, 2.0]
+
+
+def test_failed_requests_are_requested_again(tmp_path, monkeypatch, df_prices):
+    monkeypatch.setattr(prices.time, 'sleep', lambda seconds: None)
+    provider = RecordingProvider(df_prices, failures=1)
+    store = PriceStore(tmp_path, provider)
+
+    # failed requests are not added to the coverage
+    store.update(['AAA'], '2021-01-01', '2021-07-01', retries=0)
+    assert 'AAA' not in store.coverage.index
+    assert store.update(['AAA'], '2021-01-01', '2021-07-01', retries=0) == 1
+    assert store.coverage.at['AAA', 'status'] == 'ok'